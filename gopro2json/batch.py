@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import os
+import re
+import sys
+import json
+import time
+import signal
+import argparse
+import collections
+import multiprocessing
+from multiprocessing.connection import wait
+
+from . import config
+from . gopro2json import Parse360ToJson
+
+# GoPro file names carry the chapter and the file number of the recording:
+#   GH01xxxx.MP4, GX01xxxx.MP4, GS01xxxx.360   chapter 01, 02... of file xxxx
+#   GOPRxxxx.MP4, GP01xxxx.MP4                 first chapter, then 01, 02... (HERO5 and older)
+chapter_names = [
+    (re.compile(r'^(G[HXS])(\d\d)(\d{4})\.(mp4|360)$', re.I), lambda m: (m.group(1).upper(), int(m.group(2)), m.group(3))),
+    (re.compile(r'^(GOPR)(\d{4})\.mp4$', re.I), lambda m: ('GP', 0, m.group(2))),
+    (re.compile(r'^(GP)(\d\d)(\d{4})\.mp4$', re.I), lambda m: ('GP', int(m.group(2)), m.group(3))),
+]
+
+# A recording split in chapter files, converted as one job.
+Session = collections.namedtuple('Session', 'name files output')
+
+# The outcome of a job: status is ok, failed or timeout.
+JobResult = collections.namedtuple('JobResult', 'session status error elapsed')
+
+
+def find_sessions(paths, outputdir=None):
+    """
+    Walks the directories (and files) in paths and groups the GoPro chapter
+    files into sessions: same directory, same encoding prefix and same file
+    number, chapters in order.
+
+    The output goes next to the first chapter, or with outputdir in the same
+    directories under it, relative to the paths searched: the file numbers
+    start over on every card and DCIM folder, so GH010001.MP4 of two folders
+    mustn't write the same GH010001.json (nor .gpmi).
+    """
+    chapters = collections.defaultdict(set)
+    roots = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            roots.append(os.path.dirname(path))
+            walk = [(os.path.dirname(path), [], [os.path.basename(path)])]
+        else:
+            roots.append(path)
+            walk = os.walk(path)
+        for dirpath, dirnames, filenames in walk:
+            dirnames.sort()
+            for filename in filenames:
+                for regex, key in chapter_names:
+                    m = regex.match(filename)
+                    if m:
+                        prefix, chapter, number = key(m)
+                        chapters[(dirpath, prefix, number)].add((chapter, os.path.join(dirpath, filename)))
+                        break
+
+    base = os.path.commonpath(roots) if roots else None
+    sessions = []
+    for (dirpath, prefix, number), files in sorted(chapters.items()):
+        files = [f for chapter, f in sorted(files)]
+        name, ext = os.path.splitext(os.path.basename(files[0]))
+        if outputdir:
+            directory = os.path.normpath(os.path.join(outputdir, os.path.relpath(dirpath, base)))
+        else:
+            directory = dirpath
+        sessions.append(Session(name, files, os.path.join(directory, '%s.json' % name)))
+    return sessions
+
+
+def convert(session, workers, verbose, cache, index, columns, conn):
+    "job body, runs in its own process and reports back through conn"
+    # In a process group of its own, the job is stopped with the chapter
+    # workers and the ffmpeg it started, see stop.
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    try:
+        Parse360ToJson(session.files, session.output, verbose=verbose, workers=workers, cache=cache, index=index, columns=columns)
+        conn.send(None)
+    except BaseException as error:
+        conn.send('%s: %s' % (type(error).__name__, error))
+    finally:
+        conn.close()
+
+
+def stop(process, grace=5):
+    """
+    Terminates the job process and its process group, killing what is still
+    alive after grace seconds.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        process.terminate()
+    process.join(grace)
+    if process.is_alive():
+        process.kill()
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        pass
+    process.join()
+
+
+def run_sessions(sessions, jobs=1, timeout=None, workers=None, verbose=False, cache=None, index=False, columns=False):
+    """
+    Converts the sessions with at most jobs processes at a time. A job running
+    longer than timeout seconds is stopped, with everything it started.
+    Returns a JobResult per session, in the order of sessions.
+
+    workers, verbose, cache, index and columns are handed to Parse360ToJson
+    for each session.
+    """
+    # Fail early if the binaries can't be found. Forked job processes inherit
+    # the lookup; with spawn (the default on macOS and Windows) every job
+    # process starts empty and does it once itself.
+    config.find_tools()
+
+    pending = collections.deque(enumerate(sessions))
+    running = {}
+    results = [None] * len(sessions)
+
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                position, session = pending.popleft()
+                recv, send = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=convert, args=(session, workers, verbose, cache, index, columns, send))
+                process.start()
+                send.close()
+                running[process.sentinel] = (position, session, process, recv, time.time())
+                if verbose:
+                    print('Started %s (%d files)' % (session.name, len(session.files)))
+
+            now = time.time()
+            wait_for = None
+            if timeout:
+                wait_for = max(0, min(started + timeout for _, _, _, _, started in running.values()) - now)
+            ready = wait(list(running.keys()), wait_for)
+
+            now = time.time()
+            for sentinel in list(running.keys()):
+                position, session, process, recv, started = running[sentinel]
+                if sentinel in ready:
+                    error = recv.recv() if recv.poll() else 'exited with code %s' % process.exitcode
+                    process.join()
+                    status = 'ok' if error is None else 'failed'
+                elif timeout and now - started >= timeout:
+                    stop(process)
+                    error = 'timed out after %ss' % timeout
+                    status = 'timeout'
+                else:
+                    continue
+                recv.close()
+                del running[sentinel]
+                results[position] = JobResult(session, status, error, round(now - started, 3))
+                if verbose:
+                    print('%s %s%s' % (status, session.name, ': %s' % error if error else ''))
+    except BaseException:
+        # The jobs are in process groups of their own, Ctrl-C doesn't reach them.
+        for position, session, process, recv, started in running.values():
+            stop(process)
+        raise
+
+    return results
+
+
+def report(results, fd=sys.stdout):
+    "summary of the batch, one line per session and the totals"
+    counts = collections.Counter(r.status for r in results)
+    for r in results:
+        fd.write('%-8s %-12s %7.2fs %s%s\n' % (r.status, r.session.name, r.elapsed, r.session.output,
+            ' (%s)' % r.error if r.error else ''))
+    fd.write('%d sessions: %d ok, %d failed, %d timeout, %.2fs\n' % (len(results),
+        counts['ok'], counts['failed'], counts['timeout'], sum(r.elapsed for r in results)))
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Convert every GoPro recording found in the directories to JSON.")
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="count")
+    parser.add_argument("-j", "--jobs", help="sessions converted at the same time", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-w", "--workers", help="processes reading the chapter files of a session", type=int, default=None)
+    parser.add_argument("-t", "--timeout", help="seconds allowed per session", type=float, default=None)
+    parser.add_argument("-o", "--outputdir", help="write the JSON files here instead of next to the videos", default=None)
+    parser.add_argument("-r", "--report", help="write the summary as JSON to this file", default=None)
+    parser.add_argument("-c", "--cache", help="keep extracted and parsed files in this directory for the next runs", default=None)
+    parser.add_argument("-i", "--index", help="write a .gpmi index next to each output and use it on the next runs", action="store_true")
+    parser.add_argument("--columns", help="also write the samples as a columnar binary file (.cols)", action="store_true")
+    parser.add_argument("paths", help="directories (searched recursively) or files", nargs="+")
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    sessions = find_sessions(args.paths, args.outputdir)
+    if not sessions:
+        print("No GoPro recordings found in %s" % ' '.join(args.paths))
+        return 0
+
+    for session in sessions:
+        os.makedirs(os.path.dirname(session.output), exist_ok=True)
+
+    results = run_sessions(sessions, max(1, args.jobs), args.timeout, args.workers, args.verbose, args.cache, args.index, args.columns)
+    report(results)
+
+    if args.report:
+        with open(args.report, 'w') as fd:
+            json.dump([dict(r._asdict(), session=r.session._asdict()) for r in results], fd, indent=2)
+
+    return 0 if all(r.status == 'ok' for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
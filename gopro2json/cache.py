@@ -0,0 +1,104 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import os
+import pickle
+import hashlib
+import tempfile
+
+
+class Cache:
+    """
+    On-disk cache of the extracted gpmd track and of the parsed recordings.
+
+    Entries are keyed by the identity of the source file (path, size, mtime),
+    so a file that changes gets new entries. The directory is kept under
+    max_size bytes by removing the least recently used entries; a hit
+    refreshes the entry's mtime.
+    """
+    def __init__(self, directory, max_size=1 << 30):
+        self.directory = directory
+        self.max_size = max_size
+        # bytes in the directory as of the last evict plus what was put
+        # since, the directory is only listed again when it goes over
+        self.size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, fname, *extra):
+        "hex digest identifying fname as it is now, plus any extra parameters"
+        stat = os.stat(fname)
+        identity = repr((os.path.abspath(fname), stat.st_size, stat.st_mtime_ns) + extra)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def path(self, key, kind):
+        return os.path.join(self.directory, '%s.%s' % (key, kind))
+
+    def get(self, key, kind):
+        "the cached bytes, or None"
+        path = self.path(key, kind)
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def put(self, key, kind, data):
+        # write to a temporary file and rename, so concurrent readers never see half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self.path(key, kind))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+        if self.size is not None:
+            self.size += len(data)
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+
+    def getObject(self, key, kind):
+        data = self.get(key, kind)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            # written by another version of the code, treat as a miss
+            return None
+
+    def putObject(self, key, kind, obj):
+        self.put(key, kind, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def evict(self):
+        "remove the least recently used entries until the cache fits in max_size"
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
@@ -7,43 +7,74 @@
 #
 
 import os
-import subprocess
-import platform
-import sys
+import shutil
+
+from . cache import Cache
+
+# Resolved (ffmpeg, ffprobe) binaries, looked up once per process.
+tools_cache = {}
 
 class Config:
     def __init__(self, ffmpeg, ffprobe):
         self.ffmpeg_cmd = ffmpeg
         self.ffprobe_cmd = ffprobe
+        self.verbose = False
+        self.file = None
+        self.outputfile = None
+        self.cache = None
+        self.index = False
+
+    def forFile(self, filename, outputfile=None, verbose=None):
+        """
+        Returns a Config for filename sharing these binaries, so one Config
+        can be reused for any number of files without discovering the tools again.
+        """
+        config = Config(self.ffmpeg_cmd, self.ffprobe_cmd)
+        config.verbose = self.verbose if verbose is None else verbose
+        config.cache = self.cache
+        config.index = self.index
+        config.file = filename
+        if (outputfile != None):
+            config.outputfile = outputfile
+        else:
+            file_name, ext = os.path.splitext(filename)
+            config.outputfile = '{}.json'.format(file_name)
+        return config
 
-def setup_environment(filename="", outputfile=None, binary=False, verbose=False):
+def find_tools(ffmpeg=None, ffprobe=None):
     """
-    The output of platform.system() is as follows:
-    Linux: Linux
-    Mac: Darwin
-    Windows: Windows
+    Resolves the ffmpeg and ffprobe binaries. Explicit arguments win, then the
+    FFMPEG_PATH and FFPROBE_PATH environment variables, then the PATH.
+    The lookup is done once per process and cached.
     """
-    if platform.system().lower() == 'windows':
-        # config = Config('C:\\Software\\ffmpeg\\bin\\ffmpeg.exe', 'C:\\Software\\ffmpeg\\bin\\ffprobe.exe')
-        config = Config('ffmpeg.exe', 'ffprobe.exe')
-    else:
-        ffmpeg = subprocess.run(["which", "ffmpeg"], capture_output=True).stdout.decode('utf-8').strip()
-        ffprobe = subprocess.run(["which", "ffprobe"], capture_output=True).stdout.decode('utf-8').strip()
+    ffmpeg = ffmpeg or os.environ.get('FFMPEG_PATH') or 'ffmpeg'
+    ffprobe = ffprobe or os.environ.get('FFPROBE_PATH') or 'ffprobe'
+
+    key = (ffmpeg, ffprobe)
+    if key not in tools_cache:
+        # shutil.which honours PATHEXT, so 'ffmpeg' finds ffmpeg.exe on windows.
+        tools_cache[key] = (shutil.which(ffmpeg) or ffmpeg, shutil.which(ffprobe) or ffprobe)
+    return tools_cache[key]
+
+def setup_environment(filename="", outputfile=None, binary=False, verbose=False, ffmpeg=None, ffprobe=None, cache=None, index=False):
+    """
+    Builds the Config for filename. The binaries can be given explicitly,
+    through FFMPEG_PATH / FFPROBE_PATH, or are looked up in the PATH.
+    cache is a cache.Cache, or a directory to keep one in. index writes and
+    reuses a GPMFIndex sidecar per file, next to the output.
+    """
+    ffmpeg, ffprobe = find_tools(ffmpeg, ffprobe)
+    if verbose:
         print('Configuring ffmpeg to: ', ffmpeg)
         print('Configuring ffprobe to: ', ffprobe)
-        config = Config(ffmpeg, ffprobe)
+    config = Config(ffmpeg, ffprobe)
+    config.verbose = verbose
+    if isinstance(cache, str):
+        cache = Cache(cache)
+    config.cache = cache
+    config.index = index
 
     if (len(filename)):
-        file_name, ext = os.path.splitext(filename)
-
-        # configure arguments
-        config.verbose = verbose
-        config.file = filename
-        if (outputfile != None):
-            config.outputfile = outputfile
-        else:
-            config.outputfile = '{}.json'.format(file_name)
+        config = config.forFile(filename, outputfile)
 
     return config
-
-    
\ No newline at end of file
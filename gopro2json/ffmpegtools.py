@@ -7,8 +7,20 @@
 #
 
 import subprocess
-import re
-from datetime import datetime
+import os
+import json
+import collections
+from fractions import Fraction
+from datetime import timedelta
+
+# Everything Parser needs from ffprobe, read from a single probe of the file.
+ProbeResult = collections.namedtuple('ProbeResult', 'date duration fps chapters metadata_track')
+
+# Probe results memoized per (path, size, mtime), shared by all FFMpegTools.
+# Only the most recently used are kept, a batch worker probes many files.
+probe_cache = collections.OrderedDict()
+probe_cache_size = 256
+
 class FFMpegTools:
 
     def __init__(self, config):
@@ -24,31 +36,86 @@ class FFMpegTools:
         output = result.stdout
         return output
 
-    def getMetadataTrack(self, fname):
+    def probe(self, fname):
         """
-        % ffprobe GH010039.MP4 2>&1
+        Runs ffprobe once per file and parses the json output into a ProbeResult:
 
-        The channel marked as gpmd (Stream #0:3(eng): Data: none (gpmd / 0x646D7067), 29 kb/s (default))
-        In this case, the stream #0:3 is the required one (get the 3)
+        $ ffprobe -v error -show_format -show_streams -show_chapters -of json GS010064.360
+
+        The result is memoized per (path, size, mtime), so asking again for the
+        same unchanged file doesn't spawn ffprobe at all. The probe_cache_size
+        most recently used files are kept; a failed probe isn't.
+        """
+        stat = os.stat(fname)
+        key = (os.path.abspath(fname), stat.st_size, stat.st_mtime_ns)
+        result = probe_cache.get(key)
+        if result is not None:
+            probe_cache.move_to_end(key)
+            return result
+
+        info = self.runProbe(fname)
+        if info is None:
+            # maybe transient (a file still being copied...), so not kept:
+            # the next call probes again.
+            return self.parseProbe({})
+
+        result = self.parseProbe(info)
+        probe_cache[key] = result
+        if len(probe_cache) > probe_cache_size:
+            probe_cache.popitem(last=False)
+        return result
+
+    def runProbe(self, fname):
+        "the ffprobe json document of fname, None if ffprobe failed or gave nothing"
+        args = [ '-v', 'error', '-show_format', '-show_streams', '-show_chapters', '-of', 'json', fname ]
+        result = subprocess.run([ self.config.ffprobe_cmd ] + args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        output = result.stdout.decode('utf-8').strip()
+        if result.returncode != 0 or not output:
+            return None
+        return json.loads(output) or None
+
+    def parseProbe(self, info):
+        "Build the ProbeResult from the ffprobe json document."
+        fmt = info.get('format', {})
+        streams = info.get('streams', [])
+        video = next((x for x in streams if x.get('codec_type') == 'video'), {})
+
+        # Every stream has the same creation time, so just one is good enough.
+        date = fmt.get('tags', {}).get('creation_time', '')
+        if not date:
+            date = next((x['tags']['creation_time'] for x in streams if 'creation_time' in x.get('tags', {})), '')
+
+        duration = float(video.get('duration', fmt.get('duration', 0.0)))
+
+        rate = video.get('r_frame_rate', '0/1')
+        fps = float(Fraction(rate)) if rate != '0/0' else 0.0
+
+        chapters = [{ 'start': float(x['start_time']), 'end': float(x['end_time']) } for x in info.get('chapters', [])]
+
+        metadata_track = None
+        for x in streams:
+            if x.get('codec_tag_string') == 'gpmd':
+                metadata_track = (int(x['index']), 'Stream #0:%d: Data: %s (gpmd)' % (x['index'], x.get('tags', {}).get('handler_name', '')))
+                break
+
+        return ProbeResult(date, duration, fps, chapters, metadata_track)
+
+    def getMetadataTrack(self, fname):
+        """
+        The stream whose codec tag is gpmd holds the metadata, e.g.
 
-        Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'GH010039.MP4':
-            Stream #0:1(eng): Audio: aac (LC) (mp4a / 0x6134706D), 48000 Hz, stereo, fltp, 189 kb/s (default)
-            Stream #0:2(eng): Data: none (tmcd / 0x64636D74), 0 kb/s (default)
             Stream #0:3(eng): Data: none (gpmd / 0x646D7067), 29 kb/s (default)
-            Stream #0:4(eng): Data: none (fdsc / 0x63736466), 12 kb/s (default)
-        """      
-        output = self.runCmd(self.config.ffprobe_cmd, [fname])
-        # Stream #0:3(eng): Data: bin_data (gpmd / 0x646D7067), 29 kb/s (default)
-        # Stream #0:2(eng): Data: none (gpmd / 0x646D7067), 29 kb/s (default)
-        reg = re.compile('Stream #\d:(\d)\(.+\): Data: \w+ \(gpmd', flags=re.I|re.M)
-        m = reg.search(output)
-        
-        if not m:
-            return(None)
-        return(int(m.group(1)), m.group(0))
 
-    def getMetadata(self, track, fname):
+        In this case, the stream #0:3 is the required one (get the 3).
+        Returns (3, description), or None if the file has no gpmd stream.
+        """
+        return self.probe(fname).metadata_track
 
+    def getMetadata(self, track, fname):
+        """
+        The raw stream track of fname (see getMetadataTrack), copied out by
+        ffmpeg. Parser only uses it when the MP4 sample tables can't be read.
+        """
         output_file = "-"
         args = [ '-y', '-i', fname, '-codec', 'copy', '-map', '0:%d' % track, '-f', 'rawvideo', output_file ] 
         output = self.runCmdRaw(self.config.ffmpeg_cmd, args)
@@ -74,14 +141,7 @@ class FFMpegTools:
         The datetime object is ready to consume as it is just read from the file.
         Every stream has this same information, so just one is good enough.
         """
-        output = self.runCmd(self.config.ffprobe_cmd, [fname])
-        # Stream #0:3(eng): Data: bin_data (gpmd / 0x646D7067), 29 kb/s (default)
-        # Stream #0:2(eng): Data: none (gpmd / 0x646D7067), 29 kb/s (default)
-        # reg = re.compile('Stream #\d:(\d)\(.+\): Data: \w+ \(gpmd', flags=re.I|re.M)
-        # m = reg.search(output)
-
-        dates = re.findall(r'creation_time   : (.+Z)', output)
-        date = (dates[0] if dates else '')
+        date = self.probe(fname).date
         if self.config.verbose == 2:
             print("GoPro recording date: %s" % date)
         return date
@@ -100,24 +160,20 @@ class FFMpegTools:
           Chapter #0:5: start 124.200000, end 136.040000
           Stream #0:0(eng): Video: hevc (Main) (hvc1 / 0x31637668), yuvj420p(pc, bt709), 4096x1344 [SAR 1:1 DAR 64:21], 29996 kb/s, 25 fps, 25 tbr, 90k tbn, 25
 
+        The same values are read from the json probe, see probe().
+
         Args:
             fname (String): Specified filename to target
         """
-        args = '-v error -select_streams v:0 -show_entries stream=duration -sexagesimal -of default=noprint_wrappers=1:nokey=1 ' + fname
-        args = args.split(' ')
-        output = self.runCmdRaw(self.config.ffprobe_cmd, args).decode('utf-8').strip()
-        duration = datetime.strptime(output, '%H:%M:%S.%f') - datetime(1900, 1, 1)
+        duration = self.probe(fname).duration
 
         if self.config.verbose == 2:
-            print("GoPro recording duration: %s" % duration)
-        return duration.total_seconds()
+            print("GoPro recording duration: %s" % timedelta(seconds=duration))
+        return duration
 
     def getFps(self, fname):
         """Get actual fps of specified video file."""
-        args = '-v 0 -of csv=p=0 -select_streams v:0 -show_entries stream=r_frame_rate ' + fname
-        args = args.split(' ')
-        output = self.runCmdRaw(self.config.ffprobe_cmd, args).decode('utf-8').strip()
-        fps = eval(output)
+        fps = self.probe(fname).fps
 
         if self.config.verbose == 2:
             print("GoPro recording actual fps: %s" % fps)
@@ -140,11 +196,8 @@ class FFMpegTools:
         Args:
             fname (String): Specified filename to target
         """
-        output = self.runCmd(self.config.ffprobe_cmd, [fname])
-
-        chapters = re.findall(r'.*start (\d+\.\d+), end (\d+\.\d+)', output)
-        chapters[:] = [{ 'start': float(x[0]), 'end': float(x[1]) } for x in chapters]
+        chapters = self.probe(fname).chapters
         if self.config.verbose == 2:
-            print("GoPro recording date: %s" % chapters)
+            print("GoPro recording chapters: %s" % chapters)
         return chapters
 
@@ -9,8 +9,11 @@
 
 import struct
 import time
+from datetime import datetime
 import collections
 import copy
+import itertools
+import operator
 
 maptype = { 'c': 'c',
 			'L': 'L',
@@ -26,6 +29,16 @@ maptype = { 'c': 'c',
 	}
 
 
+# Compiled Structs, keyed by format string (type and repeat), shared by all the labels.
+structs = {}
+
+def compiled(fmt):
+	"cached struct.Struct for fmt, so the formats are compiled only once"
+	s = structs.get(fmt)
+	if s is None:
+		s = structs[fmt] = struct.Struct(fmt)
+	return s
+
 def map_type(type):
 	ctype = chr(type)
 	if ctype in maptype.keys():
@@ -42,6 +55,60 @@ GPSData = collections.namedtuple("GPSData","lat lon alt speed speed3d")
 KARMAGPSData = collections.namedtuple("KARMAGPSData", "tstamp lat lon alt speed speed3d unk1 unk2 unk3 unk4")
 SYSTData = collections.namedtuple("SYSTData", "seconds miliseconds")
 
+
+def unpack_columns(klvdata, width):
+	"""
+	Decode every sample of the payload in one unpack and split the values
+	into width columns, one tuple per axis.
+	"""
+	stype = map_type(klvdata.type)
+	s = compiled('>' + stype * width * klvdata.repeat)
+	values = s.unpack_from(klvdata.rawdata)
+	return [values[i::width] for i in range(width)]
+
+def scale_columns(columns, scal):
+	"""
+	Divide each column by its SCAL value. SCAL is either a single value
+	for all the axes or one value per axis.
+	"""
+	if not isinstance(scal, (tuple, list)):
+		scal = (scal,) * len(columns)
+	return [tuple(map(operator.truediv, c, itertools.repeat(v))) for c, v in zip(columns, scal)]
+
+class XYZSamples(collections.namedtuple('XYZSamples', "x y z")):
+	"All the samples of a XYZ payload, one column per axis"
+	__slots__ = ()
+
+	def sample(self, i=0):
+		return XYZData(self.x[i], self.y[i], self.z[i])
+
+	def scale(self, scal):
+		return XYZSamples._make(scale_columns(self, scal))
+
+class WXYZSamples(collections.namedtuple('WXYZSamples', "w x y z")):
+	"All the samples of a WXYZ payload, one column per axis"
+	__slots__ = ()
+
+	def sample(self, i=0):
+		return WXYZData(self.w[i], self.x[i], self.y[i], self.z[i])
+
+	def scale(self, scal):
+		return WXYZSamples._make(scale_columns(self, scal))
+
+class GPSSamples(collections.namedtuple('GPSSamples', "lat lon alt speed speed3d")):
+	"All the samples of a GPS5 payload, one column per field"
+	__slots__ = ()
+
+	def count(self):
+		return len(self.lat)
+
+	def sample(self, i=0):
+		return GPSData(self.lat[i], self.lon[i], self.alt[i], self.speed[i], self.speed3d[i])
+
+	def scale(self, scal):
+		"SCAL of GPS5 has a value per field"
+		return GPSSamples._make(scale_columns(self, scal))
+
 class LabelBase:
 	def __init__(self):
 		pass
@@ -50,8 +117,8 @@ class LabelBase:
 		if not klvdata.rawdata:
 			return None
 		stype = map_type(klvdata.type)
-		s = struct.Struct('>' + stype)
-		data = s.iter_unpack(klvdata.rawdata).__next__()
+		s = compiled('>' + stype)
+		data = s.unpack_from(klvdata.rawdata)
 		if (len(data)>0):
 			return (data[0])
 		return(None)
@@ -63,7 +130,7 @@ class LabelEmpty(LabelBase):
 	def Build(self, klvdata):
 		if not klvdata.rawdata:
 			return None
-		return klvdata.rawdata[0:10]
+		return bytes(klvdata.rawdata[0:10])
 
 class Label_TypecString(LabelBase):
 	"c 1 X"
@@ -71,7 +138,7 @@ class Label_TypecString(LabelBase):
 		LabelBase.__init__(self)
 
 	def Build(self, klvdata):
-		return(klvdata.rawdata.decode('utf-8', errors='replace').strip('\0'))
+		return(str(klvdata.rawdata, 'utf-8', errors='replace').strip('\0'))
 
 class Label_TypeFloat(LabelBase):
 	"c 1 X"
@@ -85,8 +152,8 @@ class Label_TypeFloat(LabelBase):
 		# if more than 1 item in repeat, return a list (GPS data)
 		stype = map_type(klvdata.type)
 		fmt = '>' + stype * klvdata.repeat
-		s = struct.Struct(fmt)
-		data = s.iter_unpack(klvdata.rawdata).__next__()
+		s = compiled(fmt)
+		data = s.unpack_from(klvdata.rawdata)
 		if (len(data)>0):
 			return (data[0])
 		return(0.0)
@@ -97,10 +164,10 @@ class Label_TypeUTimeStamp(LabelBase):
 		LabelBase.__init__(self)
 
 	def Build(self, klvdata):
-		s = klvdata.rawdata.decode('utf-8', errors='replace')
-		# 'yymmddhhmmss.sss'
+		s = str(klvdata.rawdata, 'utf-8', errors='replace').strip('\0')
+		# 'yymmddhhmmss.sss', UTC. A datetime keeps the milliseconds.
 		fmt = '%y%m%d%H%M%S.%f'
-		return time.strptime(s, fmt)
+		return datetime.strptime(s, fmt)
 
 class LabelDVID(LabelBase):
 	def __init__(self):
@@ -160,7 +227,7 @@ class LabelSCAL(LabelBase):
 		# if more than 1 item in repeat, return a list (GPS data)
 		stype = map_type(klvdata.type)
 		fmt = '>' + stype * klvdata.repeat
-		s = struct.Struct(fmt)
+		s = compiled(fmt)
 		data = s.unpack_from(klvdata.rawdata)
 		return(data)
 
@@ -182,7 +249,7 @@ class LabelDISP(LabelBase):
 		# if more than 1 item in repeat, return a list (GPS data)
 		stype = map_type(klvdata.type)
 		fmt = '>' + stype * klvdata.repeat
-		s = struct.Struct(fmt)
+		s = compiled(fmt)
 		data = s.unpack_from(klvdata.rawdata)
 		return(data)
 
@@ -197,10 +264,8 @@ class LabelXYZData(LabelBase):
 		if klvdata.size != 6 and klvdata.size != 12:
 			raise Exception("Invalid length for XYZ packet")
 
-		# we need to process the SCAL value to measure properly the DATA
-		stype = map_type(klvdata.type)
-		s = struct.Struct('>' + stype*3)
-		data = XYZData._make(s.iter_unpack(klvdata.rawdata[0:klvdata.length]).__next__())
+		# SCAL comes in its own label, use XYZSamples.scale to measure properly the DATA
+		data = XYZSamples._make(unpack_columns(klvdata, 3))
 		return(data)
 
 class LabelWXZYData(LabelBase):
@@ -214,10 +279,8 @@ class LabelWXZYData(LabelBase):
 		if klvdata.size != 8 and klvdata.size != 16:
 			raise Exception("Invalid length for WXZY packet")
 
-		# we need to process the SCAL value to measure properly the DATA
-		stype = map_type(klvdata.type)
-		s = struct.Struct('>' + stype*4)
-		data = WXYZData._make(s.iter_unpack(klvdata.rawdata[0:klvdata.length]).__next__())
+		# SCAL comes in its own label, use WXYZSamples.scale to measure properly the DATA
+		data = WXYZSamples._make(unpack_columns(klvdata, 4))
 		return(data)
 
 class LabelACCL(LabelXYZData):
@@ -314,7 +377,7 @@ class LabelUNIT(LabelBase):
 		# 5 fields of length 3	
 		stype = map_type(klvdata.type)
 		fmt = '>' + ( (str(klvdata.size) + 's') * klvdata.repeat )
-		s = struct.Struct(fmt)
+		s = compiled(fmt)
 		data_tuple = s.unpack_from(klvdata.rawdata)
 		
 		# if len(data_tuple) ==15:
@@ -336,18 +399,19 @@ class LabelGPS5(LabelBase):
 		LabelBase.__init__(self)
 
 	def Build(self, klvdata):
-		# 5 fields of length 4 (l)
+		# 5 fields of length 4 (l), repeated once per sample (~18 per payload)
 
 		if not klvdata.rawdata:
-			# empty point
-			data = GPSData(0,0,0,0,0)
+			# empty payload
+			data = GPSSamples((), (), (), (), ())
 		else:
-			stype = map_type(klvdata.type)
-			s = struct.Struct('>' + stype * 5 )
-			data = GPSData._make( s.unpack_from(klvdata.rawdata) )
+			# SCAL comes in its own label, use GPSSamples.scale to measure properly the DATA
+			data = GPSSamples._make(unpack_columns(klvdata, 5))
 		return(data)
 
 class LabelGPRI(LabelBase):
+	karma_type = "".join( [map_type(ord(x)) for x in 'JlllSSSSBB' ])
+
 	def __init__(self):
 		LabelBase.__init__(self)
 
@@ -361,15 +425,11 @@ class LabelGPRI(LabelBase):
 		GPRI ? 30 4 {b'\x00\x00\x00\x00\tI\xb4\xde\x13\xbe'} |b'\x00\x00\x00\x00\tI\xb4\xde\x13\xbe'| [	
 		
 		"""
-		karma_type = 'JlllSSSSBB'
-		s_karma_type = "".join( [map_type(ord(x)) for x in karma_type ])
-
 		if not klvdata.rawdata:
 			# empty point
 			data = GPSData(0,0,0,0,0)
 		else:
-			stype = map_type(klvdata.type)
-			s = struct.Struct('>' + s_karma_type )
+			s = compiled('>' + LabelGPRI.karma_type)
 			data_tuple = s.unpack_from(klvdata.rawdata)
 			data = KARMAGPSData._make( data_tuple )
 		return(data)
@@ -378,6 +438,8 @@ class LabelSYST(LabelBase):
 	"""
 	UTC time and data from GPS, 1Hz n/a
 	"""
+	karma_type = "".join( [map_type(ord(x)) for x in 'JJ' ])
+
 	def __init__(self):
 		Label_TypeUTimeStamp.__init__(self)
 
@@ -392,11 +454,7 @@ class LabelSYST(LabelBase):
 		if not klvdata.rawdata:
 			data = SYSTData(0,0)
 		else:
-			karma_type = 'JJ'
-			s_karma_type = "".join( [map_type(ord(x)) for x in karma_type ])
-			stype = map_type(klvdata.type)
-
-			s = struct.Struct('>' + s_karma_type )
+			s = compiled('>' + LabelSYST.karma_type)
 			data_tuple = s.unpack_from(klvdata.rawdata)
 			data = SYSTData._make( data_tuple )
 		return(data)
@@ -512,9 +570,13 @@ skip_labels = [
 ]
 
 
+# The labels are stateless, one decoder instance per FourCC is registered once.
+decoders = dict((k, v()) for k, v in labels.items())
+
 def Manage(klvdata):
-	if klvdata.fourCC in labels:
-		return labels[klvdata.fourCC]().Build(klvdata)
+	decoder = decoders.get(klvdata.fourCC)
+	if decoder is not None:
+		return decoder.Build(klvdata)
 	else:
 		return None
 
@@ -20,20 +20,34 @@ import platform
 import argparse
 from collections import namedtuple
 import array
+import operator
 import sys
 import time
-from datetime import datetime
+import signal
+import threading
+from datetime import datetime, timedelta
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat, compress
 
 from . import config
 from . import gpmf
 from . import fourCC
+from . import samplestore
+from . import gpmfindex
+from . import gpshelper
+from . ffmpegtools import ProbeResult
 import time
 import sys
 
 import json
 
   
+# The sample streams Build360Points turns into the JSON document.
+DATAS = ['CORI', 'ACCL', 'GRAV', 'GYRO']
+# TODO: WF-132 Fix the MAGN stream from newer GoPros.
+# DATAS = ['CORI', 'ACCL', 'GRAV', 'MAGN', 'GYRO']
+
 def most_frequent(List):
     occurence_count = Counter(List)
     return occurence_count.most_common(1)[0][0]
@@ -58,10 +72,7 @@ def Build360Points(data, skip=False):
     VPTS_init = None
     CTS = 0
 
-    DATAS = ['CORI', 'ACCL', 'GRAV', 'GYRO']
-    # TODO: WF-132 Fix the MAGN stream from newer GoPros.
-    # DATAS = ['CORI', 'ACCL', 'GRAV', 'MAGN', 'GYRO']
-    samples = []
+    samples = samplestore.SampleStore()
     streams = {'streams': {
         'datas': DATAS,
         'samples': samples
@@ -83,48 +94,203 @@ def Build360Points(data, skip=False):
         # elif d.fourCC == 'DISP':
         #     sample[d.fourCC] = d.data
         elif d.fourCC in DATAS:
-            sample = { 'CTS': CTS, 'VPTS': VPTS, 'SCAL': SCAL } if len(samples) == 0 else samples[-1]
-            if sample['CTS'] < CTS:
-                sample = { 'CTS': CTS, 'VPTS': VPTS, 'SCAL': SCAL }
-
             if not d.data:
                 continue
 
-            sample[d.fourCC] = d.data._asdict()
-            # listdict = list(map(lambda x: x._asdict(), d.data))
+            # A new frame starts a new sample, otherwise the reading goes to the last one.
+            if len(samples) == 0 or samples.cts[-1] < CTS:
+                i = samples.append(CTS, VPTS, SCAL)
+            else:
+                i = len(samples) - 1
 
-            # Correct the polarity of the data to right handed coordsys.
-            if (type(d.data) == fourCC.WXYZData):
-                sample[d.fourCC]['z'] = -sample[d.fourCC]['z']
+            # The payload holds every sample, the stream keeps one per frame.
+            samples.set(i, d.fourCC, d.data.sample(0), 'd' if chr(d.type) in 'fd' else 'q')
 
-            if (type(d.data) == fourCC.XYZData):
-                sample[d.fourCC]['y'] = -sample[d.fourCC]['y']
-                sample[d.fourCC]['z'] = -sample[d.fourCC]['z']
+    # Correct the polarity of the data to right handed coordsys.
+    for stream in samples.streams.values():
+        if stream.axes == fourCC.WXYZData._fields:
+            stream.negate('z')
+        if stream.axes == fourCC.XYZData._fields:
+            stream.negate('y')
+            stream.negate('z')
 
-            if len(samples) == 0 or samples[-1]['CTS'] < CTS:
-                samples.append(sample)
-
-    mapped = list(map(lambda a: \
-        (a[1]['VPTS'] or 0) - (a[0]['VPTS'] or 0), \
-        zip(samples, samples[1:])))
-    streams['streams']['FPS'] = 1 / (most_frequent(mapped) / 1000 / 1000)
+    streams['streams']['FPS'] = 1 / (most_frequent(samples.intervals()) / 1000 / 1000)
     return streams
 
-def Parse360ToJson(files=[], output=None, binary=False, verbose=None):
+def BuildGPSPoints(data, skip=False, max_dop=None):
+    """
+    The GPS5 stream as a gpshelper.GPSTrack, every sample of every payload.
+    Each payload is scaled with its SCAL (a value per field) in one go, and
+    its samples are spread evenly from its GPSU time to the next payload's.
+
+    skip drops the payloads without a GPS lock (GPSF 0; a stream without
+    GPSF is kept), max_dop the ones whose GPSP (dilution of precision x100,
+    under 500 is good) is above it. Empty points (0, 0, 0) are always
+    dropped.
+
+    The Karma drone has GPRI instead, one point per payload timed by SYST.
+    """
+    SCAL = 1.0
+    GPSU = None
+    GPSF = None
+    GPSP = None
+    SYST = None
+    karma = gpshelper.GPSTrack()
+
+    # GPSU, scaled samples and whether to keep them, for every payload
+    blocks = []
+    for d in data:
+        if d.fourCC == 'SCAL':
+            SCAL = d.data
+        elif d.fourCC == 'GPSU':
+            GPSU = d.data
+        elif d.fourCC == 'GPSF':
+            GPSF = d.data
+        elif d.fourCC == 'GPSP':
+            GPSP = d.data
+        elif d.fourCC == 'GPS5':
+            if not d.data or not d.data.count() or GPSU is None:
+                continue
+            keep = not (skip and GPSF == 0) and not (max_dop is not None and GPSP is not None and GPSP > max_dop)
+            blocks.append((GPSU, d.data.scale(SCAL) if keep else d.data, keep))
+        elif d.fourCC == 'SYST':
+            seconds, miliseconds = map(operator.truediv, d.data, SCAL)
+            if seconds and miliseconds:
+                SYST = datetime(1970, 1, 1) + timedelta(seconds=miliseconds)
+        elif d.fourCC == 'GPRI':
+            if not isinstance(d.data, fourCC.KARMAGPSData):
+                # empty payload
+                continue
+            gpri = fourCC.KARMAGPSData._make(map(operator.truediv, d.data, SCAL))
+            if gpri.lat == gpri.lon == gpri.alt == 0 or SYST is None:
+                continue
+            karma.append(gpri.lat, gpri.lon, gpri.alt, SYST, gpri.speed)
+
+    points = gpshelper.GPSTrack()
+    # GPSU ticks at 1Hz, the spacing of a payload without a next one is the previous one's
+    interval = timedelta(seconds=1)
+    for i, (start, samples, keep) in enumerate(blocks):
+        if i + 1 < len(blocks) and blocks[i + 1][0] > start:
+            interval = blocks[i + 1][0] - start
+        if not keep:
+            continue
+
+        # a payload at a time, column by column
+        t0 = gpshelper.Seconds(start)
+        step = interval.total_seconds() / samples.count()
+        times = [t0 + step * j for j in range(samples.count())]
+        mask = [not (lat == lon == alt == 0) for lat, lon, alt in zip(samples.lat, samples.lon, samples.alt)]
+        points.extend(*(compress(column, mask)
+            for column in (samples.lat, samples.lon, samples.alt, times, samples.speed)))
+
+    points.extend(karma.latitude, karma.longitude, karma.elevation, karma.time, karma.speed)
+    return points
+
+# Everything Parse360ToJson needs from one input file, read in a single pass.
+Recording = namedtuple('Recording', 'config data camera date fps duration chapters')
+
+def ReadRecording(cfg, f, output=None):
+    """
+    Opens and probes the file once, returning its telemetry and probe results.
+    cfg is a Config shared by all the files, see Config.forFile.
+    """
+    cfg = cfg.forFile(f, outputfile=output)
+
+    # The sidecar index spares the box walk and ffprobe, and points at the
+    # payloads holding DATAS.
+    index = None
+    if cfg.index:
+        path = gpmfindex.index_path(f, cfg.outputfile)
+        index = gpmfindex.GPMFIndex.load(path, f)
+
+    # A file seen before skips the probe, the video read and the decode.
+    if cfg.cache is not None:
+        key = cfg.cache.key(f, DATAS)
+        recording = cfg.cache.getObject(key, 'recording')
+        if recording is not None:
+            if cfg.index and index is None:
+                probe = ProbeResult(recording.date, recording.duration, recording.fps, recording.chapters, None)
+                gpmf.Parser(cfg).buildIndex(probe).save(path)
+            return recording._replace(config=cfg)
+
+    parser = gpmf.Parser(cfg, fourccs=DATAS, index=index)
+    data = parser.readFromMP4()
+    recording = Recording(cfg, data, parser.readCameraSerial(), parser.date,
+        parser.sourceFps, parser.duration, parser.chapters)
+
+    if cfg.index and index is None:
+        parser.buildIndex().save(path)
+
+    if cfg.cache is not None:
+        cfg.cache.putObject(key, 'recording', recording._replace(config=None))
+    return recording
+
+def ReadRecordings(cfg, files, output=None, workers=None):
+    """
+    ReadRecording for every file, in order. With workers > 1 the files are
+    probed, extracted and parsed in a pool of processes; the results are
+    merged back in the order of files.
+    """
+    if not workers or workers < 2 or len(files) < 2:
+        return [ReadRecording(cfg, f, output) for f in files]
+
+    # The workers die with the default SIGTERM, whatever the parent handles.
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(files)),
+        initializer=signal.signal, initargs=(signal.SIGTERM, signal.SIG_DFL))
+    # A terminated parent leaves its pool running, so SIGTERM is turned into
+    # an exception stopping the pool, like KeyboardInterrupt.
+    handling = threading.current_thread() is threading.main_thread()
+    if handling:
+        previous = signal.signal(signal.SIGTERM, RaiseTerminated)
+    try:
+        recordings = list(executor.map(ReadRecording, repeat(cfg), files, repeat(output)))
+    except BaseException:
+        StopPool(executor)
+        raise
+    finally:
+        if handling:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL if previous is None else previous)
+    executor.shutdown()
+    return recordings
+
+def RaiseTerminated(signum, frame):
+    raise SystemExit("Terminated by signal %d" % signum)
+
+def StopPool(executor, grace=1):
+    "cancels what the pool hasn't started and stops its workers, killing them after grace seconds"
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(grace)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+def Parse360ToJson(files=[], output=None, binary=False, verbose=None, workers=None, cache=None, index=False, columns=False):
+    """
+    Converts the chapter files of one recording, in order, to a single JSON
+    document. workers sets the number of processes reading the files in parallel.
+    cache is a directory (or cache.Cache) keeping the extracted and parsed files
+    for the next run. index writes a .gpmi sidecar per file next to the output,
+    used instead of walking the file and probing it on the next runs.
+    columns also writes the samples as a columnar binary file (.cols) next to
+    the JSON, see samplestore.dump_columns.
+    """
+    cfg = config.setup_environment(verbose=verbose, cache=cache, index=index)
+    recordings = ReadRecordings(cfg, files, output, workers)
+    last = recordings[-1]
+
     datas = []
-    anchors = []
-    sourceFps = 1.0
-    for f in files:
-        cfg = config.setup_environment(f, outputfile=output)
-        parser = gpmf.Parser(cfg)
-        datas.extend(parser.readFromMP4())
-        CASN = parser.readCameraSerial()
-        sourceFps = 0 + parser.sourceFps
+    for recording in recordings:
+        datas.extend(recording.data)
+    sourceFps = 0 + last.fps
 
     streams = Build360Points(datas)
-    streams['camera'] = CASN
-    streams['source'] = cfg.outputfile
-    streams['date'] = parser.date
+    streams['camera'] = last.camera
+    streams['source'] = last.config.outputfile
+    streams['date'] = last.date
 
     # Enhance details to the streams:
     # TODO: Move expansion rate calculations to user responsibility.
@@ -133,10 +299,9 @@ def Parse360ToJson(files=[], output=None, binary=False, verbose=None):
     streams['streams']['sourceFPS'] = sourceFps
     streams['streams']['expansionRate'] = expansionRate
 
+    anchors = []
     prevDuration = 0
-    for f in files:
-        cfg = config.setup_environment(f, outputfile=output)
-        parser = gpmf.Parser(cfg)
+    for recording in recordings:
         anchors.extend(
             list(
                 map(
@@ -144,27 +309,42 @@ def Parse360ToJson(files=[], output=None, binary=False, verbose=None):
                         'start': round(x['start'] * expansionRate + prevDuration, 2),
                         'end': round(x['end'] * expansionRate + prevDuration, 2)
                     },
-                    parser.chapters
+                    recording.chapters
                 )
             )
         )
-        prevDuration = parser.duration * expansionRate
+        prevDuration = recording.duration * expansionRate
 
     streams['anchors'] = anchors
 
     if len(streams) == 0:
-        print("Can't create file. No camera info in %s. Exitting" % cfg.file)
+        print("Can't create file. No camera info in %s. Exitting" % last.config.file)
         sys.exit(0)
 
-    fd = open("%s" % cfg.outputfile, "w+")
-    fd.write(json.dumps(streams))
+    fd = open("%s" % last.config.outputfile, "w+")
+    samplestore.dump(streams, fd)
     fd.close()
 
+    if columns:
+        WriteColumns(streams, last.config.outputfile)
+
+def WriteColumns(streams, outputfile):
+    "the samples of the Build360Points document as <outputfile stem>.cols, the rest in its layout"
+    samples = streams['streams']['samples']
+    document = dict(streams, streams=dict((k, v) for k, v in streams['streams'].items() if k != 'samples'))
+    file_name, ext = os.path.splitext(outputfile)
+    with open('{}.cols'.format(file_name), 'wb') as fd:
+        samplestore.dump_columns(samples, fd, document)
+
 def parseArgs():
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--verbose", help="increase output verbosity", action="count")
     parser.add_argument("-b", "--binary", help="read data from bin file", action="store_true")
     parser.add_argument("-s", "--skip", help="Skip bad points (GPSFIX=0)", action="store_true", default=False)
+    parser.add_argument("-g", "--gps", help="write the GPS track as GPX and KML instead of the 360 JSON", action="store_true")
+    parser.add_argument("--dop", help="skip GPS points with a dilution of precision (x100) above this, e.g. 500", type=int, default=None)
+    parser.add_argument("--simplify", help="simplify the GPS track, keeping it within this many meters", type=float, default=None)
+    parser.add_argument("--decimate", help="keep a GPS point every this many seconds at most", type=float, default=None)
     parser.add_argument("file", help="Video file or binary metadata dump")
     args = parser.parse_args()
 
@@ -173,7 +353,7 @@ def parseArgs():
 if __name__ == "__main__":
 
     args = parseArgs()
-    config = config.setup_environment(args.file, args.binary, args.verbose)
+    config = config.setup_environment(args.file, binary=args.binary, verbose=args.verbose)
     parser = gpmf.Parser(config)
 
     if not args.binary:
@@ -183,6 +363,26 @@ if __name__ == "__main__":
 
     CASN = parser.readCameraSerial()
 
+    if args.gps:
+        points = BuildGPSPoints(data, skip=args.skip, max_dop=args.dop)
+        if len(points) == 0:
+            print("Can't create file. No GPS info in %s. Exitting" % config.file)
+            sys.exit(0)
+        if args.simplify or args.decimate:
+            count = len(points)
+            points = gpshelper.simplify(points, tolerance=args.simplify, interval=args.decimate)
+            if args.verbose:
+                print("GPS points: %d of %d" % (len(points), count))
+        elif args.verbose:
+            print("GPS points: %d" % len(points))
+
+        file_name, ext = os.path.splitext(config.outputfile)
+        with open("%s.gpx" % file_name, "w") as fd:
+            gpshelper.write_GPX(points, fd, trk_name="%s-track" % os.path.basename(file_name))
+        with open("%s.kml" % file_name, "w") as fd:
+            gpshelper.write_KML(points, fd)
+        sys.exit(0)
+
     streams = Build360Points(data, skip=args.skip)
 
     if len(streams) == 0:
@@ -197,5 +397,5 @@ if __name__ == "__main__":
     # Write the results
     #
     fd = open("%s.json" % config.outputfile, "w+")
-    fd.write(json.dumps(streams))
+    samplestore.dump(streams, fd)
     fd.close()
@@ -22,145 +22,236 @@ https://www.kaggle.com/humananalog/examine-mp4-files-with-python-only
 '''
 
 import os
-import array
 import sys
-import struct
 import re
 
-from . ffmpegtools import FFMpegTools
+from . ffmpegtools import FFMpegTools, ProbeResult
+from . mp4tools import MP4Tools, open_mmap
+from . import mp4tools
 from . klvdata import KLVData
+from . gpmftree import GPMFTree, wanted_labels, expand_labels, stream_wanted
+from . gpmfindex import GPMFIndex
 
 
 
 class Parser:
-    def __init__(self, config):
+    def __init__(self, config, fourccs=None, index=None):
+        """
+        fourccs limits decoding to the given sample FourCCs (e.g. ['GPS5'] or
+        ['CORI', 'GRAV']), with the FourCCs other devices write the same
+        samples as (GPS5 brings the Karma's GPRI and SYST, see
+        gpmftree.alternate_labels). The metadata describing the streams is
+        always kept, every other payload is skipped by its header length
+        without being read.
+
+        index is a GPMFIndex of the file (see buildIndex). With it the MP4
+        boxes aren't walked, ffprobe isn't run, and only the payloads holding
+        the fourccs are read.
+        """
         self.config = config
+        self.fourccs = fourccs
+        self.index = index
         self.ffmtools = FFMpegTools(self.config)
+        self.mp4tools = MP4Tools(self.config)
 
         # map some handy shortcuts
         self.verbose = config.verbose
         self.file = config.file
         self.outputfile = config.outputfile
 
-        self.date = self.ffmtools.getDate(self.file)
-        self.duration = self.ffmtools.getDuration(self.file)
-        self.sourceFps = self.ffmtools.getFps(self.file)
-        self.chapters = self.ffmtools.getChapters(self.file)
+        # probed and located on first use
+        self._probe = None
+        self._track = None
+
+    def probe(self):
+        "ProbeResult of the file, from the index when there is one"
+        if self._probe is None:
+            if self.index is not None:
+                self._probe = self.index.probe
+            else:
+                self._probe = ProbeResult(self.ffmtools.getDate(self.file), self.ffmtools.getDuration(self.file),
+                    self.ffmtools.getFps(self.file), self.ffmtools.getChapters(self.file), None)
+        return self._probe
+
+    @property
+    def date(self):
+        return self.probe().date
+
+    @property
+    def duration(self):
+        return self.probe().duration
+
+    @property
+    def sourceFps(self):
+        return self.probe().fps
+
+    @property
+    def chapters(self):
+        return self.probe().chapters
+
+    @property
+    def track(self):
+        "SampleTable of the gpmd track, None if the file has none"
+        if self._track is None:
+            if self.index is not None:
+                self._track = self.index.track
+            else:
+                self._track = self.mp4tools.getMetadataTrack(self.file)
+        return self._track
+
+    def buildIndex(self, probe=None):
+        """
+        GPMFIndex of the file, save it with its save(path) and pass it back as
+        index. probe is the ProbeResult of the file when known already (e.g.
+        cached), so ffprobe isn't run for it.
+        """
+        if self.track is None:
+            raise Exception("File %s doesn't have any metadata" % self.file)
+        with open_mmap(self.file) as data:
+            return GPMFIndex.build(self.file, self.track, probe or self.probe(), data)
 
     def find_boxes(self, f, start_offset=0, end_offset=float("inf")):
         """
         Returns a dictionary of all the data boxes and their absolute starting
-        and ending offsets inside the mp4 file.
+        and ending offsets inside the mp4 file. f is the file opened in binary
+        mode, or its mmap (any buffer); the file is mapped and the headers are
+        read in place.
 
-        Specify a start_offset and end_offset to read sub-boxes.
+        Specify a start_offset and end_offset to read sub-boxes. A repeated
+        box type (trak) keeps only the last box: mp4tools.find_boxes lists
+        them all, and mp4tools.BoxIndex looks boxes up by path.
         """
-        s = struct.Struct("> I 4s")
         boxes = {}
-        offset = start_offset
-        f.seek(offset, 0)
-        while offset < end_offset:
-            data = f.read(8)               # read box header
-            if data == b"": break          # EOF
-            length, text = s.unpack(data)
-            f.seek(length - 8, 1)          # skip to next box
-            boxes[text] = (offset, offset + length)
-            offset += length or 8
+        with mp4tools.as_buffer(f) as data:
+            for box in mp4tools.find_boxes(data, start_offset, min(end_offset, len(data))):
+                boxes[box.type] = (box.start, box.end)
         return boxes
 
     def parse_highlights(self, f, start_offset=0, end_offset=float('inf')):
+        """
+        Highlight (HiLight) times in seconds, from the GPMF box of udta found
+        between start_offset and end_offset of f (the file opened in binary
+        mode, or its mmap).
 
-        inHighlights = False
-        inHLMT = False
-
-        listOfHighlights = []
-
-        offset = start_offset
-        f.seek(offset, 0)
-
-        while offset < end_offset:
-            data = f.read(4)               # read box header
-            if data == b'': break          # EOF
-
-            if data == b'High' and inHighlights == False:
-                data = f.read(4)
-                if data == b'ligh':
-                    inHighlights = True  # set flag, that highlights were reached
-
-            if data == b'HLMT' and inHighlights == True and inHLMT == False:
-                inHLMT = True  # set flag that HLMT was reached
-
-            if data == b'MANL' and inHighlights == True and inHLMT == True:
-
-                currPos = f.tell()  # remember current pointer/position
-                f.seek(currPos - 20)  # go back to highlight timestamp
-
-                data = f.read(4)  # readout highlight
-                timestamp = int.from_bytes(data, 'big')  #convert to integer
-
-                if timestamp != 0:
-                    listOfHighlights.append(timestamp)  # append to highlightlist
-
-                f.seek(currPos)  # go forward again (to the saved position)
-
-        return list(map(lambda x: x / 1000, listOfHighlights))
-
+        The box is plain KLV. Inside HLMT a highlight is a record of numeric
+        KLVs, the first one its time in milliseconds, with a KLV tagging how
+        it was made; the manual ones (MANL) are returned, in order.
+        """
+        with mp4tools.as_buffer(f) as data:
+            box = bytes(data[start_offset:min(end_offset, len(data))])
+        highlights = []
+        self.walk_highlights(memoryview(box), 0, len(box), False, highlights)
+        return list(map(lambda x: x / 1000, highlights))
+
+    def walk_highlights(self, data, offset, end, inHLMT, highlights):
+        "collects the MANL timestamps of the KLVs between offset and end, entering containers"
+        timestamp = None
+        record = None
+        # a truncated container stops where the box does
+        end = min(end, len(data))
+        while offset + 8 <= end:
+            key, type, size, repeat = KLVData.header.unpack_from(data, offset)
+            padded_length = (size * repeat + 3) & ~3
+            if key == b'HLMT':
+                inHLMT = True
+
+            if type == 0:
+                inHLMT = self.walk_highlights(data, offset + 8, offset + 8 + padded_length, inHLMT, highlights)
+            elif inHLMT:
+                raw = bytes(data[offset + 8:offset + 8 + size * repeat])
+                if key == b'MANL' or b'MANL' in raw:
+                    if timestamp:
+                        highlights.append(timestamp)
+                    timestamp = None
+                elif chr(type) in 'LlJj' and size in (4, 8) and repeat == 1:
+                    # the key of the time starts every record
+                    if timestamp is None or key == record:
+                        timestamp = int.from_bytes(raw, 'big', signed=chr(type) in 'lj')
+                        record = key
+                else:
+                    # tagged some other way, not a manual highlight
+                    timestamp = None
+
+            offset += 8 + padded_length
+        return inHLMT
 
     def extractHighlightTimecodes(self):
-        # TODO: Consider dropping this code. I can sort of see the use for other things maybe.
-        # Same information is directly available from ffprobe output.
-
+        "manual highlights of the video in seconds, read from moov/udta/GPMF"
         if not os.path.exists(self.file):
             raise FileNotFoundError("Can't open %s" % self.file)
 
-        with open(self.file, "rb") as f:
-            boxes = self.find_boxes(f)
-
-            if boxes[b"ftyp"][0] != 0:
+        with open_mmap(self.file) as data:
+            index = mp4tools.BoxIndex(data)
+            ftyp = index.first('ftyp')
+            if ftyp is None or ftyp.start != 0:
                 raise Exception("File is not a mp4-video-file!")
 
-            # mdat_boxes = self.find_boxes(f, boxes[b"mdat"][0] + 8, boxes[b"mdat"][1])
-            moov_boxes = self.find_boxes(f, boxes[b"moov"][0] + 8, boxes[b"moov"][1])
-        
-            udta_boxes = self.find_boxes(f, moov_boxes[b"udta"][0] + 8, moov_boxes[b"udta"][1])
-            # mvhd_boxes = self.find_boxes(f, moov_boxes[b"mvhd"][0] + 8, moov_boxes[b"mvhd"][1])
-            # iods_boxes = self.find_boxes(f, moov_boxes[b"iods"][0] + 8, moov_boxes[b"iods"][1])
-            # trak_boxes = self.find_boxes(f, moov_boxes[b"trak"][0] + 8, moov_boxes[b"trak"][1])
-
-            # mdia_boxes = self.find_boxes(f, trak_boxes[b"mdia"][0] + 8, trak_boxes[b"mdia"][1])
+            box = index.first('moov/udta/GPMF')
+            if box is None:
+                return []
+            return self.parse_highlights(data, box.start + box.header, box.end)
 
-            ### get GPMF Box
-            # highlights = parse_highlights(f, udta_boxes[b'GPMF'][0] + 8, udta_boxes[b'GPMF'][1])
+    def readFromMP4(self, start=None, end=None):
+        """read data the metadata track from video. The gpmd payloads are read
+           directly from the MP4 sample tables, no ffmpeg pass is needed.
+           start and end (seconds) limit it to the payloads covering that
+           time range, see readRawFromMP4.
+           -vv creates a dump file with the  binary data called dump_track.bin
+        """
+        metadata_raw = self.readRawFromMP4(start, end)
 
-            # f.seek(udta_boxes[b'GPMF'][0] + 8, 0)
-            # out = f.read(udta_boxes[b'GPMF'][1])
-            # return out
+        # process the data here
+        metadata = []
+        metadata.extend(self.parseStream(metadata_raw))
 
-            highlights = self.parse_highlights(f, udta_boxes[b'GPMF'][0] + 8, udta_boxes[b'GPMF'][1])
-            return highlights
+        # We could be processing a lot more data from the other containers too. Right now this is unstable.
+        # metadata_raw_too = self.examine_mp4(self.file)
+        # metadata.extend(self.parseStream(metadata_raw_too))
 
-            # print("")
-            # print("Filename:", filename)
-            # print("Found", len(highlights), "Highlight(s)!")
-            # print('Here are all Highlights: ', highlights)
+        return(metadata)
 
-            # return highlights
+    def readTreeFromMP4(self, start=None, end=None):
+        "read the metadata track from video as a GPMFTree, see parseTree"
+        return self.parseTree(self.readRawFromMP4(start, end))
 
+    def readRawFromMP4(self, start=None, end=None):
+        """
+        the raw gpmd track of the video. With start and/or end (seconds) only
+        the payloads overlapping [start, end) are read, found from the timing
+        of the sample table (stts); the rest of the file isn't touched. With
+        an index, payloads without any of the fourccs are left out too:
 
-    def readFromMP4(self):
-        """read data the metadata track from video. Requires FFMPEG wrapper.
-           -vv creates a dump file with the  binary data called dump_track.bin
+            klvs = parser.readFromMP4(600, 620)
         """
-        
         if not os.path.exists(self.file):
             raise FileNotFoundError("Can't open %s" % self.file)
 
-        track_number, lineinfo = self.ffmtools.getMetadataTrack(self.file)
-        if not track_number:
-            raise Exception("File %s doesn't have any metadata" % self.file)
-        
-        if self.verbose:
-            print("Working on file %s track %s (%s)" % (self.file, track_number, lineinfo))
-        metadata_raw = self.ffmtools.getMetadata(track_number, self.file)
+        ranged = start is not None or end is not None
+        cache = None if ranged else self.config.cache
+        metadata_raw = None
+        if cache is not None:
+            key = cache.key(self.file)
+            metadata_raw = cache.get(key, 'gpmd')
+
+        if metadata_raw is None:
+            track = self.track
+            if track is None:
+                if ranged:
+                    raise Exception("File %s has no gpmd sample table to read a time range from" % self.file)
+                metadata_raw = self.readRawWithFFMpeg()
+                whole = True
+            else:
+                payloads = range(*self.mp4tools.payloadRange(track, start, end))
+                if self.index is not None and self.fourccs is not None:
+                    payloads = self.index.select(payloads, expand_labels(self.fourccs))
+                if self.verbose:
+                    print("Working on file %s track %s (%d of %d payloads)" % (self.file, track.track, len(payloads), len(track.sizes)))
+                metadata_raw = self.mp4tools.getMetadata(track, self.file, payloads)
+                whole = len(payloads) == len(track.sizes)
+            if cache is not None and whole:
+                cache.put(key, 'gpmd', metadata_raw)
+        elif self.verbose:
+            print("Working on file %s, gpmd track from the cache" % self.file)
 
         if self.verbose == 2:
             print("Creating output file for binary data (fromMP4): %s" % self.outputfile)
@@ -168,16 +259,21 @@ class Parser:
             f.write(metadata_raw)
             f.close()
 
-        
-        # process the data here
-        metadata = []
-        metadata.extend(self.parseStream(metadata_raw))
-
-        # We could be processing a lot more data from the other containers too. Right now this is unstable.
-        # metadata_raw_too = self.examine_mp4(self.file)
-        # metadata.extend(self.parseStream(metadata_raw_too))
+        return metadata_raw
 
-        return(metadata)
+    def readRawWithFFMpeg(self):
+        """
+        the gpmd track copied out by ffmpeg, the way it was read before the
+        sample tables: for files mp4tools finds no gpmd trak in, when ffprobe
+        still sees a gpmd stream.
+        """
+        metadata_track = self.ffmtools.getMetadataTrack(self.file)
+        if metadata_track is None:
+            raise Exception("File %s doesn't have any metadata" % self.file)
+        track_number, lineinfo = metadata_track
+        if self.verbose:
+            print("Working on file %s track %s (%s), with ffmpeg" % (self.file, track_number, lineinfo))
+        return self.ffmtools.getMetadata(track_number, self.file)
 
     def readFromBinary(self):
         """read data from binary file, instead extract the metadata track from video. Useful for quick development
@@ -188,10 +284,12 @@ class Parser:
 
         if self.verbose:
             print("Reading binary file %s" % (self.file))
-        
-        fd = open(self.file, 'rb')
-        data = fd.read()
-        fd.close()
+
+        # The KLVs hold views on the data, so it is read rather than mapped:
+        # a map would stay open, and the file locked, as long as they live.
+        # A dump is only the gpmd track, small next to the video.
+        with open(self.file, 'rb') as fd:
+            data = fd.read()
 
         if self.verbose == 2:
             print("Creating output file for binary data (from binary): %s" % self.outputfile)
@@ -205,15 +303,31 @@ class Parser:
 
     def parseStream(self, data_raw):
         """
-        main code that reads the points
+        main code that reads the points. data_raw can be any buffer (bytes,
+        bytearray, mmap); the labels get zero-copy views of their payloads.
+        A tail too short for a KLV header is ignored.
         """
-        data = array.array('b')
-        data.fromstring(data_raw)
+        data = memoryview(data_raw)
+        wanted = wanted_labels(self.fourccs)
 
         offset = 0
+        end = len(data)
         klvlist = []
 
-        while offset < len(data):
+        while offset + 8 <= end:
+
+            key, type, size, repeat = KLVData.header.unpack_from(data, offset)
+            padded_length = (size * repeat + 3) & ~3
+
+            if wanted is not None:
+                if key == b'STRM':
+                    skip = not stream_wanted(data, offset + 8, offset + 8 + padded_length, wanted)
+                else:
+                    skip = type != 0 and not key in wanted
+                if skip:
+                    # not asked for, don't even look at the payload
+                    offset += 8 + padded_length
+                    continue
 
             try:
                 klv = KLVData(data,offset)
@@ -221,16 +335,26 @@ class Parser:
                     klvlist.append(klv)
                     if self.verbose == 3:
                         print(klv)
-                offset += 8
-                if klv.type != 0:
-                    offset += klv.padded_length
-                    #print(">offset:%d length:%d padded:%d" % (offset, length, padded_length))
             except Exception as error:
                 print(error)
-                offset += 8
-                offset += klv.padded_length
+
+            offset += 8
+            if type != 0:
+                offset += padded_length
             
         return(klvlist)
+
+    def parseTree(self, data_raw):
+        """
+        Same data as parseStream, nested as devices (DEVC) holding their
+        streams (STRM) by FourCC, with the sticky metadata (STNM, SCAL, UNIT,
+        SIUN, TYPE, TSMP, STMP...) attached to every payload:
+
+            tree = parser.parseTree(data)
+            accl = tree.stream('ACCL')
+            scal = accl.payloads[0].metadata['SCAL']
+        """
+        return GPMFTree(self.verbose, self.fourccs).parse(data_raw)
     
     def readCameraSerial(self):
         fd = open(self.file, 'rb')
@@ -0,0 +1,183 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import os
+import sys
+import json
+import array
+import struct
+
+from . klvdata import KLVData
+from . mp4tools import SampleTable
+from . ffmpegtools import ProbeResult
+
+# Sidecar layout, little-endian:
+#   header   magic, version, length of the info document
+#   info     json: source identity, track, timescale, probe results, FourCCs
+#   columns  offset (Q), size (I), time (d), duration (d), streams (Q) per payload
+magic = b'GPMI'
+version = 1
+header = struct.Struct('<4sHI')
+
+columns = [('offsets', 'Q'), ('sizes', 'I'), ('times', 'd'), ('durations', 'd'), ('masks', 'Q')]
+
+
+def index_path(fname, outputfile):
+    "the sidecar of fname, next to outputfile"
+    return os.path.join(os.path.dirname(outputfile), os.path.basename(fname) + '.gpmi')
+
+
+def payload_streams(data, offset, end):
+    """
+    FourCCs of the samples in the gpmd payload between offset and end, the
+    last KLV of every STRM. Only the headers are read, a truncated tail is
+    ignored.
+    """
+    streams = []
+    end = min(end, len(data))
+    while offset + 8 <= end:
+        key, type, size, repeat = KLVData.header.unpack_from(data, offset)
+        padded_length = (size * repeat + 3) & ~3
+        if key == b'STRM':
+            last = None
+            start = offset + 8
+            stop = min(start + padded_length, end)
+            while start + 8 <= stop:
+                k, t, s, r = KLVData.header.unpack_from(data, start)
+                if t != 0:
+                    last = k
+                start += 8 + ((s * r + 3) & ~3)
+            if last is not None:
+                streams.append(last)
+        elif type == 0:
+            streams.extend(payload_streams(data, offset + 8, offset + 8 + padded_length))
+        offset += 8 + padded_length
+    return streams
+
+
+class GPMFIndex:
+    """
+    Where every gpmd payload of a recording is, when it starts and which
+    streams it holds, plus the probe results of the file. Saved next to the
+    output, it lets Parser go straight to the payloads of a stream or a time
+    window without walking the MP4 boxes or running ffprobe.
+    """
+    def __init__(self, info, track, masks):
+        self.info = info
+        self.track = track
+        self.masks = masks
+        self.fourccs = info['fourccs']
+
+    @classmethod
+    def build(cls, fname, track, probe, data):
+        "index of the SampleTable track of fname, data being the mmap of the file"
+        fourccs = []
+        masks = array.array('Q')
+        for offset, size in zip(track.offsets, track.sizes):
+            mask = 0
+            for key in payload_streams(data, offset, offset + size):
+                label = key.decode('latin-1')
+                if not label in fourccs:
+                    fourccs.append(label)
+                bit = fourccs.index(label)
+                if bit < 64:
+                    mask |= 1 << bit
+            masks.append(mask)
+
+        stat = os.stat(fname)
+        info = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'track': track.track,
+            'timescale': track.timescale,
+            'payloads': len(track.sizes),
+            'fourccs': fourccs,
+            'date': probe.date,
+            'duration': probe.duration,
+            'fps': probe.fps,
+            'chapters': probe.chapters
+        }
+        return cls(info, track, masks)
+
+    @classmethod
+    def load(cls, path, fname=None):
+        """
+        The index saved in path, or None if there is none, it can't be read or
+        fname changed since it was built.
+        """
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+            text, file_version, length = header.unpack_from(data, 0)
+            if text != magic or file_version != version:
+                return None
+            offset = header.size
+            info = json.loads(data[offset:offset + length].decode('utf-8'))
+            offset += length
+
+            values = {}
+            count = info['payloads']
+            for name, typecode in columns:
+                column = array.array(typecode)
+                size = count * column.itemsize
+                column.frombytes(data[offset:offset + size])
+                if len(column) != count:
+                    return None
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                values[name] = column
+                offset += size
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+
+        if fname is not None:
+            stat = os.stat(fname)
+            if (stat.st_size, stat.st_mtime_ns) != (info['size'], info['mtime_ns']):
+                return None
+
+        track = SampleTable(info['track'], info['timescale'], values['offsets'], values['sizes'],
+            values['times'], values['durations'])
+        return cls(info, track, values['masks'])
+
+    def save(self, path):
+        text = json.dumps(self.info).encode('utf-8')
+        values = {
+            'offsets': self.track.offsets,
+            'sizes': self.track.sizes,
+            'times': self.track.times,
+            'durations': self.track.durations,
+            'masks': self.masks
+        }
+        with open(path, 'wb') as fd:
+            fd.write(header.pack(magic, version, len(text)))
+            fd.write(text)
+            for name, typecode in columns:
+                column = array.array(typecode, values[name])
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                fd.write(column.tobytes())
+
+    @property
+    def probe(self):
+        "the ProbeResult the index was built with"
+        return ProbeResult(self.info['date'], self.info['duration'], self.info['fps'], self.info['chapters'], None)
+
+    def select(self, payloads, fourccs):
+        """
+        The payloads (indexes) holding any of the fourccs. Only the first 64
+        FourCCs of a recording have a bit; asking for one past them keeps
+        every payload.
+        """
+        mask = 0
+        for label in fourccs:
+            if not label in self.fourccs:
+                continue
+            bit = self.fourccs.index(label)
+            if bit >= 64:
+                return payloads
+            mask |= 1 << bit
+        return [i for i in payloads if self.masks[i] & mask]
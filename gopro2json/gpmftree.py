@@ -0,0 +1,204 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import collections
+
+from . klvdata import KLVData
+from . import fourCC
+
+# Labels that only describe a stream. A STRM holding nothing else has no samples.
+metadata_labels = [ "STNM", "TSMP", "TICK", "TOCK", "STMP", "TYPE", "SCAL", "UNIT", "SIUN" ]
+
+metadata_keys = set(x.encode() for x in metadata_labels)
+
+# Always decoded, whatever the caller asks for: they describe the devices,
+# the streams and their timing.
+context_labels = metadata_labels + [ "DVID", "DVNM", "VPTS", "GPSF", "GPSU", "GPSP" ]
+
+# Samples some devices write under another FourCC, asked for along with the
+# usual one: the Karma drone has its GPS as GPRI, timed by SYST.
+alternate_labels = { "GPS5": [ "GPRI", "SYST" ] }
+
+# One payload of a stream: the samples KLV, the sticky metadata valid for it
+# and the index of the DEVC payload it came from.
+StreamPayload = collections.namedtuple('StreamPayload', 'klv metadata index')
+
+
+def stream_wanted(data, offset, end, wanted):
+    """
+    True if the STRM payload between offset and end holds anything in wanted
+    besides the labels every stream has (STNM, TSMP, SCAL...). Only the
+    headers are read, a truncated tail is ignored.
+    """
+    end = min(end, len(data))
+    while offset + 8 <= end:
+        key, type, size, repeat = KLVData.header.unpack_from(data, offset)
+        if type != 0 and key in wanted and not key in metadata_keys:
+            return True
+        offset += 8 + ((size * repeat + 3) & ~3)
+    return False
+
+def expand_labels(fourccs):
+    "fourccs and the FourCCs the same samples can come as on other devices"
+    labels = list(fourccs)
+    for label in fourccs:
+        labels.extend(x for x in alternate_labels.get(label, []) if not x in labels)
+    return labels
+
+def wanted_labels(fourccs):
+    "header keys (bytes) to decode when only fourccs are asked for, None to decode all"
+    if fourccs is None:
+        return None
+    return set(x.encode() for x in expand_labels(fourccs) + context_labels)
+
+
+class GPMFStream:
+    """
+    A STRM of a device, identified by the FourCC of its samples (ACCL, GPS5...).
+    """
+    def __init__(self, fourCC):
+        self.fourCC = fourCC
+        self.metadata = {}
+        self.payloads = []
+
+    @property
+    def name(self):
+        return self.metadata.get('STNM', '')
+
+    def samples(self):
+        "the decoded sample blocks of every payload, in order"
+        return [p.klv.data for p in self.payloads]
+
+    def __str__(self):
+        return "%s '%s' %d payloads" % (self.fourCC, self.name, len(self.payloads))
+
+
+class GPMFDevice:
+    """
+    A DEVC: the camera itself or an attached device, with its streams by FourCC.
+    """
+    def __init__(self, dvid):
+        self.dvid = dvid
+        self.metadata = {}
+        self.streams = collections.OrderedDict()
+        # sticky metadata of the streams without a payload yet, by FourCC
+        self.pending = {}
+
+    @property
+    def name(self):
+        return self.metadata.get('DVNM', '')
+
+    def stream(self, fourCC):
+        return self.streams.get(fourCC)
+
+    def __str__(self):
+        return "%s %s [%s]" % (self.dvid, self.name, ' '.join(self.streams.keys()))
+
+
+class GPMFTree:
+    """
+    DEVC -> STRM -> samples, built from the raw gpmd track. Payloads of the
+    same device (DVID) and the same stream are merged in order.
+    """
+    def __init__(self, verbose=False, fourccs=None):
+        self.verbose = verbose
+        self.wanted = wanted_labels(fourccs)
+        self.devices = collections.OrderedDict()
+        self.payloads = 0
+
+    def stream(self, fourCC, dvid=None):
+        "the stream with samples fourCC, of the device dvid or the first one having it"
+        for device in self.devices.values():
+            if dvid is not None and device.dvid != dvid:
+                continue
+            if fourCC in device.streams:
+                return device.streams[fourCC]
+        return None
+
+    def children(self, data, offset, end):
+        """
+        (key, type, offset, padded_length) for every KLV between offset and end,
+        not entering containers. Only the headers are read, a tail too short
+        for a header is ignored.
+        """
+        end = min(end, len(data))
+        while offset + 8 <= end:
+            key, type, size, repeat = KLVData.header.unpack_from(data, offset)
+            padded_length = (size * repeat + 3) & ~3
+            yield key, type, offset, padded_length
+            offset += 8 + padded_length
+
+    def parse(self, data_raw):
+        data = memoryview(data_raw)
+        for key, type, offset, length in self.children(data, 0, len(data)):
+            if key != b'DEVC':
+                continue
+            try:
+                self.addDevice(data, offset + 8, offset + 8 + length)
+            except Exception as error:
+                print(error)
+            self.payloads += 1
+        return self
+
+    def addDevice(self, data, offset, end):
+        metadata = {}
+        strms = []
+        for key, type, start, length in self.children(data, offset, end):
+            if key == b'STRM':
+                strms.append((start + 8, start + 8 + length))
+            elif type != 0:
+                klv = KLVData(data, start)
+                metadata[klv.fourCC] = klv.data
+
+        dvid = metadata.get('DVID')
+        device = self.devices.get(dvid)
+        if device is None:
+            device = self.devices[dvid] = GPMFDevice(dvid)
+        device.metadata.update(metadata)
+
+        for start, stop in strms:
+            self.addStream(device, data, start, stop)
+
+    def addStream(self, device, data, offset, end):
+        """
+        The samples are the last KLV of the STRM (repeated for some streams,
+        e.g. FACE), everything before them is metadata for those samples.
+        Metadata is sticky: it stays valid until the stream repeats it.
+
+        With a filter, a stream is kept when it holds anything wanted, as
+        parseStream does, and only the wanted KLVs are decoded: a stream
+        whose samples weren't asked for can still carry a wanted VPTS or
+        GPSU. A GPMFStream is only made with its first payload, the metadata
+        seen before waits in the device's pending.
+        """
+        # decide on the headers alone, unwanted streams are never decoded
+        if self.wanted is not None and not stream_wanted(data, offset, end, self.wanted):
+            return
+        headers = [h for h in self.children(data, offset, end) if h[1] != 0]
+        if not headers:
+            return
+
+        label = headers[-1][0].decode('latin-1')
+        if label in fourCC.skip_labels or not label in fourCC.labels or label in metadata_labels:
+            return
+
+        stream = device.streams.get(label)
+        metadata = stream.metadata if stream is not None else device.pending.setdefault(label, {})
+
+        for header in headers:
+            if self.wanted is not None and not header[0] in self.wanted:
+                continue
+            klv = KLVData(data, header[2])
+            if klv.fourCC != label:
+                metadata[klv.fourCC] = klv.data
+                continue
+            if stream is None:
+                stream = device.streams[label] = GPMFStream(label)
+                stream.metadata = device.pending.pop(label)
+            stream.payloads.append(StreamPayload(klv, dict(metadata), self.payloads))
+            if self.verbose == 3:
+                print(klv)
@@ -7,16 +7,23 @@
 #
 
 
-from datetime import datetime
-import time
+from datetime import datetime, timedelta
+import itertools
+import array
+import math
 import os
 
 class GPSPoint:
-    def __init__(self, latitude=0.0, longitude=0.0, elevation=0.0, time=datetime.fromtimestamp(time.time()), speed=0.0):
+    __slots__ = ('latitude', 'longitude', 'elevation', 'time', 'speed',
+        'hr', 'cad', 'cadence', 'temperature', 'atemp', 'power', 'distance',
+        'left_pedal_smoothness', 'left_torque_effectiveness')
+
+    def __init__(self, latitude=0.0, longitude=0.0, elevation=0.0, time=None, speed=0.0):
         self.latitude = latitude
         self.longitude = longitude
         self.elevation = elevation
-        self.time = time
+        # now, when the point is made
+        self.time = time if time is not None else datetime.now()
         self.speed = speed
         # extensions
         self.hr = 0
@@ -30,109 +37,318 @@ class GPSPoint:
         self.left_torque_effectiveness = 0
 
 
+# GPSTrack keeps the times as seconds since the epoch, UTC
+epoch = datetime(1970, 1, 1)
+
+def Seconds(timedata):
+    "seconds since the epoch of the (UTC) datetime"
+    return (timedata - epoch).total_seconds()
+
+def FromSeconds(seconds):
+    return epoch + timedelta(seconds=seconds)
+
+
+class GPSTrack:
+    """
+    GPS points as columns, an array per field: latitude, longitude,
+    elevation, speed and time (seconds since the epoch, UTC). Nothing is
+    kept per point; the writers read the columns directly and iterating
+    gives GPSPoints, made on the fly.
+    """
+    def __init__(self):
+        self.latitude = array.array('d')
+        self.longitude = array.array('d')
+        self.elevation = array.array('d')
+        self.speed = array.array('d')
+        self.time = array.array('d')
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, latitude, longitude, elevation, time, speed=0.0):
+        "time is a datetime (UTC) or seconds since the epoch"
+        if isinstance(time, datetime):
+            time = Seconds(time)
+        self.latitude.append(latitude)
+        self.longitude.append(longitude)
+        self.elevation.append(elevation)
+        self.time.append(time)
+        self.speed.append(speed)
+
+    def extend(self, latitude, longitude, elevation, time, speed):
+        "adds a block of points, one iterable per field, times in seconds"
+        self.latitude.extend(latitude)
+        self.longitude.extend(longitude)
+        self.elevation.extend(elevation)
+        self.time.extend(time)
+        self.speed.extend(speed)
+
+    def point(self, i):
+        return GPSPoint(self.latitude[i], self.longitude[i], self.elevation[i], FromSeconds(self.time[i]), self.speed[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.point(i)
+
+    @classmethod
+    def fromPoints(cls, points):
+        track = cls()
+        for p in points:
+            track.append(p.latitude, p.longitude, p.elevation, p.time, p.speed)
+        return track
+
+    def take(self, indexes):
+        "GPSTrack of the points at indexes, in that order"
+        track = GPSTrack()
+        for name in ('latitude', 'longitude', 'elevation', 'speed', 'time'):
+            column = getattr(self, name)
+            getattr(track, name).extend(column[i] for i in indexes)
+        return track
+
+
+# Mean earth radius in meters, for the local projection of simplify
+earth_radius = 6371008.8
+
+def simplify(points, tolerance=None, interval=None):
+    """
+    A GPSTrack with fewer points, for the writers: full rate GPS5 (18Hz) is
+    far more than a map needs. interval (seconds) keeps a point every
+    interval at most, then tolerance (meters) drops the points that are
+    closer than it to the line between the points kept around them
+    (Douglas-Peucker). The first and last points are always kept.
+
+        gpshelper.write_GPX(gpshelper.simplify(points, tolerance=2, interval=1), fd)
+    """
+    if not isinstance(points, GPSTrack):
+        points = GPSTrack.fromPoints(points)
+    indexes = range(len(points))
+    if interval:
+        indexes = decimate(points.time, interval)
+    if tolerance:
+        indexes = douglas_peucker(points, indexes, tolerance)
+    return points.take(indexes)
+
+def decimate(times, interval):
+    "indexes of the first time of every interval seconds, and of the last one"
+    indexes = []
+    next_time = None
+    for i, t in enumerate(times):
+        if next_time is None or t >= next_time:
+            indexes.append(i)
+            next_time = t + interval
+    if indexes and indexes[-1] != len(times) - 1:
+        indexes.append(len(times) - 1)
+    return indexes
+
+def douglas_peucker(points, indexes, tolerance):
+    """
+    The indexes (of the GPSTrack points) needed to keep the track within
+    tolerance meters, horizontally. The points are projected once to meters
+    around their mean latitude, which is exact enough over a recording.
+    """
+    indexes = list(indexes)
+    if len(indexes) < 3:
+        return indexes
+
+    lat0 = math.radians(sum(points.latitude[i] for i in indexes) / len(indexes))
+    xscale = math.radians(1) * earth_radius * math.cos(lat0)
+    yscale = math.radians(1) * earth_radius
+    xs = [points.longitude[i] * xscale for i in indexes]
+    ys = [points.latitude[i] * yscale for i in indexes]
+
+    keep = bytearray(len(indexes))
+    keep[0] = keep[-1] = 1
+    # squared distances, scaled by the squared length of the segment
+    tolerance2 = tolerance * tolerance
+    segments = [(0, len(indexes) - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        x0 = xs[first]
+        y0 = ys[first]
+        dx = xs[last] - x0
+        dy = ys[last] - y0
+        length2 = dx * dx + dy * dy
+        inner = range(first + 1, last)
+        if length2:
+            distances = [(dx * (ys[i] - y0) - dy * (xs[i] - x0)) ** 2 for i in inner]
+            limit = tolerance2 * length2
+        else:
+            # back where it started, how far it went from there
+            distances = [(xs[i] - x0) ** 2 + (ys[i] - y0) ** 2 for i in inner]
+            limit = tolerance2
+        far = max(range(len(distances)), key=distances.__getitem__)
+        if distances[far] > limit:
+            far += first + 1
+            keep[far] = 1
+            segments.append((first, far))
+            segments.append((far, last))
+
+    return [index for index, kept in zip(indexes, keep) if kept]
+
+
 def UTCTime(timedata):
     #
     # time comes: 2014-05-30 20:11:27
     # should be formatted to 2014-05-30T20:11:17Z
+    # interpolated times keep their milliseconds: 2014-05-30T20:11:17.055Z
     #
-    
+    if timedata.microsecond:
+        return timedata.strftime("%Y-%m-%dT%H:%M:%S.") + "%03dZ" % (timedata.microsecond // 1000)
     return timedata.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def generate_GPX(points, trk_name="exercise"):
+def UTCTimes(seconds):
+    "UTCTime of every time in seconds since the epoch, each second formatted once"
+    last = None
+    for t in seconds:
+        whole = math.floor(t)
+        micro = round((t - whole) * 1000000)
+        if micro == 1000000:
+            whole += 1
+            micro = 0
+        if whole != last:
+            prefix = FromSeconds(whole).strftime("%Y-%m-%dT%H:%M:%S")
+            last = whole
+        yield prefix + ('.%03dZ' % (micro // 1000) if micro else 'Z')
+
+gpx_attr = [
+            'xmlns="http://www.topografix.com/GPX/1/1"' ,
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"' ,
+            'xmlns:wptx1="http://www.garmin.com/xmlschemas/WaypointExtension/v1"' ,
+            'xmlns:gpxtrx="http://www.garmin.com/xmlschemas/GpxExtensions/v3"' ,
+            'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v2"' ,
+            'xmlns:gpxx="http://www.garmin.com/xmlschemas/GpxExtensions/v3"' ,
+            'xmlns:trp="http://www.garmin.com/xmlschemas/TripExtensions/v1"' ,
+            'xmlns:adv="http://www.garmin.com/xmlschemas/AdventuresExtensions/v1"' ,
+            'xmlns:prs="http://www.garmin.com/xmlschemas/PressureExtension/v1"' ,
+            'xmlns:tmd="http://www.garmin.com/xmlschemas/TripMetaDataExtensions/v1"' ,
+            'xmlns:vptm="http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensions/v1"' ,
+            'xmlns:ctx="http://www.garmin.com/xmlschemas/CreationTimeExtension/v1"' ,
+            'xmlns:gpxacc="http://www.garmin.com/xmlschemas/AccelerationExtension/v1"',
+            'xmlns:gpxpx="http://www.garmin.com/xmlschemas/PowerExtension/v1"',
+            'xmlns:vidx1="http://www.garmin.com/xmlschemas/VideoExtension/v1"',
+
+            'creator="Garmin Desktop App"' ,
+            'version="1.1"' ,
+            'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd http://www.garmin.com/xmlschemas/WaypointExtension/v1 http://www8.garmin.com/xmlschemas/WaypointExtensionv1.xsd http://www.garmin.com/xmlschemas/TrackPointExtension/v2 http://www.garmin.com/xmlschemas/TrackPointExtensionv2.xsd http://www.garmin.com/xmlschemas/GpxExtensions/v3 http://www8.garmin.com/xmlschemas/GpxExtensionsv3.xsd http://www.garmin.com/xmlschemas/ActivityExtension/v1 http://www8.garmin.com/xmlschemas/ActivityExtensionv1.xsd http://www.garmin.com/xmlschemas/AdventuresExtensions/v1 http://www8.garmin.com/xmlschemas/AdventuresExtensionv1.xsd http://www.garmin.com/xmlschemas/PressureExtension/v1 http://www.garmin.com/xmlschemas/PressureExtensionv1.xsd http://www.garmin.com/xmlschemas/TripExtensions/v1 http://www.garmin.com/xmlschemas/TripExtensionsv1.xsd http://www.garmin.com/xmlschemas/TripMetaDataExtensions/v1 http://www.garmin.com/xmlschemas/TripMetaDataExtensionsv1.xsd http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensions/v1 http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensionsv1.xsd http://www.garmin.com/xmlschemas/CreationTimeExtension/v1 http://www.garmin.com/xmlschemas/CreationTimeExtensionsv1.xsd http://www.garmin.com/xmlschemas/AccelerationExtension/v1 http://www.garmin.com/xmlschemas/AccelerationExtensionv1.xsd http://www.garmin.com/xmlschemas/PowerExtension/v1 http://www.garmin.com/xmlschemas/PowerExtensionv1.xsd http://www.garmin.com/xmlschemas/VideoExtension/v1 http://www.garmin.com/xmlschemas/VideoExtensionv1.xsd"'
+            ]
+
+#  <trkpt lat="40.327363333" lon="-3.760243333">
+#    <time>2014-06-26T18:40:45Z</time>
+#    <fix>2d</fix>
+#    <sat>7</sat>
+#  </trkpt>
+gpx_point = (
+    '\t<trkpt lat="%s" lon="%s">\r\n'
+    '\t\t<ele>%s</ele>\r\n'
+    '\t\t<time>%s</time>\r\n'
+    '%s'
+    '\t</trkpt>\r\n'
+)
+
+# the same with every extension field, formatted in one go
+gpx_full_point = (
+    '\t<trkpt lat="%s" lon="%s">\r\n'
+    '\t\t<ele>%s</ele>\r\n'
+    '\t\t<time>%s</time>\r\n'
+    '\t\t<extensions>\r\n'
+    '\t\t<gpxtpx:TrackPointExtension>\r\n'
+    '\t\t    <gpxtpx:hr>%s</gpxtpx:hr>\r\n'
+    '\t\t    <gpxtpx:cad>%s</gpxtpx:cad>\r\n'
+    '\t\t    <gpxtpx:speed>%s</gpxtpx:speed>\r\n'
+    '\t\t    <gpxtpx:distance>%s</gpxtpx:distance>\r\n'
+    '\t\t   </gpxtpx:TrackPointExtension>\r\n'
+    '\t\t<gpxx:TrackPointExtension/>\r\n'
+    '\t\t</extensions>\r\n'
+    '\t</trkpt>\r\n'
+)
+
+# TrackPointExtension fields
+gpx_extensions = ['hr', 'cad', 'speed', 'distance']
+
+gpx_extension = '\t\t    <gpxtpx:%s>%s</gpxtpx:%s>\r\n'
 
+def GPXExtensions(values, drop_empty=False):
+    "the <extensions> of the point values (hr, cad, speed, distance), without the empty (0) fields when drop_empty"
+    fields = []
+    for tag, value in zip(gpx_extensions, values):
+        if drop_empty and not value:
+            continue
+        fields.append(gpx_extension % (tag, value, tag))
+    if drop_empty and not fields:
+        return ''
+
+    return (
+        '\t\t<extensions>\r\n'
+        '\t\t<gpxtpx:TrackPointExtension>\r\n'
+        + ''.join(fields) +
+        '\t\t   </gpxtpx:TrackPointExtension>\r\n'
+        '\t\t<gpxx:TrackPointExtension/>\r\n'
+        #'        <power>%s</power>\r\n' % power
+        #'        <<gpxtpx:temp>%s</temp>\r\n'   % temperature
+        '\t\t</extensions>\r\n'
+    )
+
+def GPXRows(points):
+    "(lat, lon, ele, time, hr, cad, speed, distance) of every point, the time formatted"
+    if isinstance(points, GPSTrack):
+        zeros = itertools.repeat(0)
+        return zip(points.latitude, points.longitude, points.elevation, UTCTimes(points.time),
+            zeros, zeros, points.speed, zeros)
+    return ((p.latitude, p.longitude, p.elevation, UTCTime(p.time), p.hr, p.cad, p.speed, p.distance) for p in points)
+
+def iter_GPX(points, trk_name="exercise", drop_empty=False):
     """
-    Creates a GPX in 1.1 Format
+    The GPX 1.1 document of points, chunk by chunk: the header, one chunk
+    per <trkpt>, then the closing tags. points is a GPSTrack, whose columns
+    are read directly, or any iterable of GPSPoints, walked once.
     """
+    rows = GPXRows(points)
+    first = next(rows, None)
 
-    xml  = '<?xml version="1.0" encoding="UTF-8"?>\r\n'
-    gpx_attr = [
-                'xmlns="http://www.topografix.com/GPX/1/1"' ,
-                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"' ,
-                'xmlns:wptx1="http://www.garmin.com/xmlschemas/WaypointExtension/v1"' ,
-                'xmlns:gpxtrx="http://www.garmin.com/xmlschemas/GpxExtensions/v3"' ,
-                'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v2"' ,
-                'xmlns:gpxx="http://www.garmin.com/xmlschemas/GpxExtensions/v3"' ,
-                'xmlns:trp="http://www.garmin.com/xmlschemas/TripExtensions/v1"' ,
-                'xmlns:adv="http://www.garmin.com/xmlschemas/AdventuresExtensions/v1"' ,
-                'xmlns:prs="http://www.garmin.com/xmlschemas/PressureExtension/v1"' ,
-                'xmlns:tmd="http://www.garmin.com/xmlschemas/TripMetaDataExtensions/v1"' ,
-                'xmlns:vptm="http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensions/v1"' ,
-                'xmlns:ctx="http://www.garmin.com/xmlschemas/CreationTimeExtension/v1"' ,
-                'xmlns:gpxacc="http://www.garmin.com/xmlschemas/AccelerationExtension/v1"',
-        'xmlns:gpxpx="http://www.garmin.com/xmlschemas/PowerExtension/v1"',
-        'xmlns:vidx1="http://www.garmin.com/xmlschemas/VideoExtension/v1"',
-
-                'creator="Garmin Desktop App"' ,
-                'version="1.1"' ,
-                'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd http://www.garmin.com/xmlschemas/WaypointExtension/v1 http://www8.garmin.com/xmlschemas/WaypointExtensionv1.xsd http://www.garmin.com/xmlschemas/TrackPointExtension/v2 http://www.garmin.com/xmlschemas/TrackPointExtensionv2.xsd http://www.garmin.com/xmlschemas/GpxExtensions/v3 http://www8.garmin.com/xmlschemas/GpxExtensionsv3.xsd http://www.garmin.com/xmlschemas/ActivityExtension/v1 http://www8.garmin.com/xmlschemas/ActivityExtensionv1.xsd http://www.garmin.com/xmlschemas/AdventuresExtensions/v1 http://www8.garmin.com/xmlschemas/AdventuresExtensionv1.xsd http://www.garmin.com/xmlschemas/PressureExtension/v1 http://www.garmin.com/xmlschemas/PressureExtensionv1.xsd http://www.garmin.com/xmlschemas/TripExtensions/v1 http://www.garmin.com/xmlschemas/TripExtensionsv1.xsd http://www.garmin.com/xmlschemas/TripMetaDataExtensions/v1 http://www.garmin.com/xmlschemas/TripMetaDataExtensionsv1.xsd http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensions/v1 http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensionsv1.xsd http://www.garmin.com/xmlschemas/CreationTimeExtension/v1 http://www.garmin.com/xmlschemas/CreationTimeExtensionsv1.xsd http://www.garmin.com/xmlschemas/AccelerationExtension/v1 http://www.garmin.com/xmlschemas/AccelerationExtensionv1.xsd http://www.garmin.com/xmlschemas/PowerExtension/v1 http://www.garmin.com/xmlschemas/PowerExtensionv1.xsd http://www.garmin.com/xmlschemas/VideoExtension/v1 http://www.garmin.com/xmlschemas/VideoExtensionv1.xsd"'
-                ]
-
-  	# BASECAMP:
-  	# - doesn't support hr=0
-  	# - doesn't support tags:
-  	# <gpxtpx:speed>1.0</gpxtpx:speed>
+    # BASECAMP:
+    # - doesn't support hr=0
+    # - doesn't support tags:
+    # <gpxtpx:speed>1.0</gpxtpx:speed>
     # <gpxtpx:distance>0</gpxtpx:distance>
+    # drop_empty leaves them out.
 
+    xml  = '<?xml version="1.0" encoding="UTF-8"?>\r\n'
     xml += "<gpx " + " ".join(gpx_attr) + ">\r\n"
 
     xml += "<metadata>\r\n"
-    xml += "  <time>%s</time>\r\n" % UTCTime(points[0].time) # first point !
+    if first is not None:
+        xml += "  <time>%s</time>\r\n" % first[3] # first point !
     xml += "</metadata>\r\n"
     xml += "<trk>\r\n"
     xml += "  <name>%s</name>\r\n" % trk_name
     xml += "<trkseg>\r\n"
+    yield xml
 
-    #
-    # add the points
-    #
-
-    #  <trkpt lat="40.327363333" lon="-3.760243333">
-    #    <time>2014-06-26T18:40:45Z</time>
-    #    <fix>2d</fix>
-    #    <sat>7</sat>
-    #  </trkpt>
+    if first is not None:
+        rows = itertools.chain([first], rows)
+        if drop_empty:
+            for row in rows:
+                yield gpx_point % (row[:4] + (GPXExtensions(row[4:], True),))
+        else:
+            for row in rows:
+                yield gpx_full_point % row
 
-    for p in points:
-        hr = p.hr
-        cadence = p.cad
-        speed = p.speed
-        distance = p.distance
+    yield "</trkseg>\r\n</trk>\r\n</gpx>\r\n"
 
-        pts  = '	<trkpt lat="%s" lon="%s">\r\n' % (p.latitude, p.longitude)
-        pts += '		<ele>%s</ele>\r\n' % p.elevation
-        pts += '		<time>%s</time>\r\n' % UTCTime(p.time)
-        pts += '		<extensions>\r\n'
-        pts += '		<gpxtpx:TrackPointExtension>\r\n'
-        pts += '		    <gpxtpx:hr>%s</gpxtpx:hr>\r\n' % hr
-        pts += '		    <gpxtpx:cad>%s</gpxtpx:cad>\r\n' % cadence
-        pts += '		    <gpxtpx:speed>%s</gpxtpx:speed>\r\n' % speed
-        pts += '		    <gpxtpx:distance>%s</gpxtpx:distance>\r\n' % distance
-        pts += '		   </gpxtpx:TrackPointExtension>\r\n'
-        pts += '		<gpxx:TrackPointExtension/>\r\n' ## new
-    	#pts += '        <power>%s</power>\r\n' % power
-    	#pts += '        <<gpxtpx:temp>%s</temp>\r\n'   % temperature
-        pts += '		</extensions>\r\n'
-        pts += '	</trkpt>\r\n'
+def write_GPX(points, fd, trk_name="exercise", drop_empty=False, block=1000):
+    "streams the GPX of points to the file object fd, block points per write"
+    write_chunks(iter_GPX(points, trk_name, drop_empty), fd, block)
 
-        xml += pts
-
-    xml += "</trkseg>\r\n"
-    xml += "</trk>\r\n"
-    xml += "</gpx>\r\n"
-
-    return xml
-
-
-
-def generate_KML(gps_points):
+def generate_GPX(points, trk_name="exercise", drop_empty=False):
     """
-    
-    use this for color
-    http://www.zonums.com/gmaps/kml_color/
-
+    Creates a GPX in 1.1 Format
     """
+    return ''.join(iter_GPX(points, trk_name, drop_empty))
+
 
-    kml_template = """<?xml version="1.0" encoding="UTF-8"?>
+kml_template = """<?xml version="1.0" encoding="UTF-8"?>
     <kml xmlns="http://www.opengis.net/kml/2.2"> <Document>
     <name>Demo</name>
     <description>Description Demo</description> 
@@ -162,12 +378,41 @@ def generate_KML(gps_points):
     </kml>
     """
 
+def iter_KML(gps_points):
+    """
+    The KML document of gps_points, chunk by chunk: everything up to
+    <coordinates>, one chunk per coordinate, then the rest.
+
+    use this for color
+    http://www.zonums.com/gmaps/kml_color/
+    """
+    if isinstance(gps_points, GPSTrack):
+        coordinates = zip(gps_points.longitude, gps_points.latitude, gps_points.elevation)
+    else:
+        coordinates = ((p.longitude, p.latitude, p.elevation) for p in gps_points)
+
+    head, tail = kml_template.split('%s')
+    yield head
+    separator = ''
+    for lon, lat, ele in coordinates:
+        yield "%s%s,%s,%s" % (separator, lon, lat, ele)
+        separator = os.linesep
+    yield tail
+
+def write_KML(gps_points, fd, block=1000):
+    "streams the KML of gps_points to the file object fd, block points per write"
+    write_chunks(iter_KML(gps_points), fd, block)
+
+def generate_KML(gps_points):
+    """
     
-    lines = []
-    for p in gps_points:
-        s = "%s,%s,%s" % (p.longitude, p.latitude, p.elevation)
-        lines.append(s)
-
-    coords = os.linesep.join(lines)
-    kml = kml_template % coords
-    return(kml)
\ No newline at end of file
+    use this for color
+    http://www.zonums.com/gmaps/kml_color/
+
+    """
+    return ''.join(iter_KML(gps_points))
+
+def write_chunks(chunks, fd, block=1000):
+    "writes the chunks to fd, joined block at a time"
+    for chunk in iter(lambda: ''.join(itertools.islice(chunks, block)), ''):
+        fd.write(chunk)
@@ -15,11 +15,11 @@ class KLVData:
             Data: 32-bit aligned, padded with 0
     """
     binary_format = '>4sBBH' 
+    header = struct.Struct(binary_format) # unsigned bytes!, shared by every record
 
     def __init__(self, data, offset):
 
-        s  = struct.Struct(KLVData.binary_format) # unsigned bytes!
-        self.fourCC, self.type, self.size, self.repeat = s.unpack_from(data, offset=offset)
+        self.fourCC, self.type, self.size, self.repeat = KLVData.header.unpack_from(data, offset)
         self.fourCC = self.fourCC.decode()
         
         self.type = int(self.type)
@@ -32,6 +32,13 @@ class KLVData:
         self.data = fourCC.Manage(self)
 
 
+    def __getstate__(self):
+        "pickles with a copy of the payload, the view on the track can't travel"
+        state = self.__dict__.copy()
+        if self.rawdata is not None:
+            state['rawdata'] = bytes(self.rawdata)
+        return state
+
     def __str__(self):
 
         stype = chr(self.type)
@@ -41,7 +48,7 @@ class KLVData:
         if self.rawdata:
             rawdata = self.rawdata
             rawdata = ' '.join(format(x, '02x') for x in rawdata)
-            rawdatas = self.rawdata[0:10]
+            rawdatas = bytes(self.rawdata[0:10])
         else: 
             rawdata = 'null'
             rawdatas = 'null'
@@ -51,17 +58,14 @@ class KLVData:
 
     def pad(self,n, base=4):
         "padd the number so is % base == 0"
-        i = n
-        while i%base != 0:
-            i+=1
-        return i
+        return (n + base - 1) // base * base
 
     def skip(self):
         return self.fourCC in fourCC.skip_labels or not self.fourCC in fourCC.labels.keys()
 
 
     def readRawData(self, data, offset):
-        "read the raw data, don't process anything, just get the bytes"
+        "read the raw data, don't process anything, just get a view on the bytes"
         if self.type == 0:
             return
 
@@ -70,9 +74,11 @@ class KLVData:
             # empty package. 
             rawdata = None
         else:
-            fmt = '>' + str(num_bytes) + 's'
-            s  = struct.Struct(fmt) 
-            rawdata, = s.unpack_from(data, offset=offset+8)
+            # a view on the payload, nothing is copied
+            start = offset + 8
+            rawdata = data[start:start + num_bytes]
+            if len(rawdata) < num_bytes:
+                raise Exception("Truncated %s payload at offset %d" % (self.fourCC, offset))
 
         return(rawdata)
         
\ No newline at end of file
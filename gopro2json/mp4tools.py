@@ -0,0 +1,306 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import io
+import os
+import re
+import mmap
+import bisect
+import struct
+import contextlib
+import collections
+
+# start and end are absolute offsets of the whole box, header is the length
+# of the box header (8, or 16 when the 64-bit largesize form is used).
+Box = collections.namedtuple('Box', 'type start end header')
+
+# One entry per gpmd payload: absolute file offset, size in bytes, and the
+# start time and duration of the payload in seconds.
+SampleTable = collections.namedtuple('SampleTable', 'track timescale offsets sizes times durations')
+
+box_header = struct.Struct('> I 4s')
+box_largesize = struct.Struct('> Q')
+
+
+def open_mmap(fname):
+    """
+    Read-only memory map of the whole file (an empty memoryview for an empty
+    file). Use it in a with block and copy out what is kept: an open map
+    keeps the file locked on Windows.
+
+        with open_mmap(fname) as data:
+            header = data[0:8]
+    """
+    with open(fname, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return memoryview(b'')
+        return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextlib.contextmanager
+def as_buffer(f):
+    """
+    f as a buffer for the with block: a file object (opened in binary mode)
+    is mapped and the map closed afterwards, a buffer (bytes, mmap,
+    memoryview) is used as it is.
+    """
+    if not isinstance(f, io.IOBase):
+        yield f
+        return
+    if os.fstat(f.fileno()).st_size == 0:
+        yield memoryview(b'')
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield data
+
+
+def find_boxes(data, start_offset=0, end_offset=None):
+    """
+    Returns the list of sibling boxes between start_offset and end_offset
+    of data (an mmap of the file, or any buffer). Handles the 64-bit
+    largesize form (size == 1, used by mdat in files over 4 GB) and boxes
+    that extend to the end of the file (size == 0).
+    """
+    if end_offset is None:
+        end_offset = len(data)
+
+    boxes = []
+    offset = start_offset
+    while offset + 8 <= end_offset:
+        length, text = box_header.unpack_from(data, offset)
+        header = 8
+        if length == 1:
+            length, = box_largesize.unpack_from(data, offset + 8)
+            header = 16
+        elif length == 0:
+            length = end_offset - offset
+        if length < header:
+            # broken box, nothing sensible can follow it.
+            break
+        boxes.append(Box(text, offset, offset + length, header))
+        offset += length
+    return boxes
+
+
+def read_box(data, box):
+    "payload of the box, without the header"
+    return data[box.start + box.header:box.end]
+
+
+class BoxIndex:
+    """
+    Tree of the boxes of an MP4 file, built lazily: the children of a box are
+    only walked the first time a path goes through it. Every sibling is kept,
+    so repeated boxes (trak) are all reachable.
+
+        with open_mmap(fname) as data:
+            index = BoxIndex(data)
+            for hdlr in index.find('moov/trak[*]/mdia/hdlr'):
+                print(index.read(hdlr))
+
+    A path step is a box type, optionally followed by [n] for the n-th box of
+    that type or [*] for all of them; without it the first one is used.
+    Only plain container boxes can be walked into.
+    """
+    path_step = re.compile(r'^(.{4})(?:\[(\*|\d+)\])?$', re.S)
+
+    def __init__(self, data):
+        self.data = data
+        self.children = {}
+
+    def boxes(self, parent=None):
+        "the boxes inside parent, or the top level boxes of the file"
+        boxes = self.children.get(parent)
+        if boxes is None:
+            if parent is None:
+                boxes = find_boxes(self.data)
+            else:
+                boxes = find_boxes(self.data, parent.start + parent.header, parent.end)
+            self.children[parent] = boxes
+        return boxes
+
+    def find(self, path, parent=None):
+        "list of the boxes matching path, starting from parent"
+        nodes = [parent]
+        for step in path.split('/'):
+            m = self.path_step.match(step)
+            if m is None:
+                raise ValueError("Bad box path step '%s' in %s" % (step, path))
+            text = m.group(1).encode('latin-1')
+            which = m.group(2)
+
+            found = []
+            for node in nodes:
+                matches = [b for b in self.boxes(node) if b.type == text]
+                if which is None:
+                    matches = matches[:1]
+                elif which != '*':
+                    matches = matches[int(which):int(which) + 1]
+                found.extend(matches)
+            nodes = found
+        return nodes
+
+    def first(self, path, parent=None):
+        "the first box matching path, or None"
+        boxes = self.find(path, parent)
+        return boxes[0] if boxes else None
+
+    def read(self, box):
+        return read_box(self.data, box)
+
+
+class MP4Tools:
+    """
+    Reads the gpmd track straight from the MP4 container, walking
+    moov/trak/mdia/minf/stbl and seeking to the payloads, so the video
+    itself is never read.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def getMetadataTrack(self, fname):
+        """
+        Locates the trak whose sample description is gpmd and returns its
+        SampleTable, or None if the file doesn't carry a metadata track.
+        """
+        with open_mmap(fname) as data:
+            index = BoxIndex(data)
+            for track, trak in enumerate(index.find('moov/trak[*]')):
+                table = self.readSampleTable(index, trak, track)
+                if table is not None:
+                    return table
+        return None
+
+    def readSampleTable(self, index, trak, track):
+        "SampleTable of the trak if it holds gpmd samples, None otherwise"
+        stbl = index.first('mdia/minf/stbl', trak)
+        if stbl is None:
+            return None
+
+        stbl_boxes = {}
+        for b in index.boxes(stbl):
+            stbl_boxes.setdefault(b.type, b)
+
+        if not b'stsd' in stbl_boxes:
+            return None
+        # version/flags, entry_count, then the first entry: size, format
+        stsd = index.read(stbl_boxes[b'stsd'])
+        if stsd[12:16] != b'gpmd':
+            return None
+
+        mdhd = self.readRequired(index, index.first('mdia/mdhd', trak), 'mdia/mdhd', track)
+        if mdhd[0] == 1:
+            timescale, = struct.unpack_from('>I', mdhd, 20)
+        else:
+            timescale, = struct.unpack_from('>I', mdhd, 12)
+
+        sizes = self.readSizes(self.readRequired(index, stbl_boxes.get(b'stsz'), 'stsz', track))
+        if b'co64' in stbl_boxes:
+            data = index.read(stbl_boxes[b'co64'])
+            count, = struct.unpack_from('>I', data, 4)
+            chunks = struct.unpack_from('>%dQ' % count, data, 8)
+        else:
+            data = self.readRequired(index, stbl_boxes.get(b'stco'), 'stco', track)
+            count, = struct.unpack_from('>I', data, 4)
+            chunks = struct.unpack_from('>%dI' % count, data, 8)
+
+        offsets = self.readOffsets(self.readRequired(index, stbl_boxes.get(b'stsc'), 'stsc', track), chunks, sizes)
+        times, durations = self.readTimes(self.readRequired(index, stbl_boxes.get(b'stts'), 'stts', track),
+            timescale, len(sizes))
+
+        if self.config.verbose == 2:
+            print("GoPro gpmd track %d: %d payloads" % (track, len(sizes)))
+        return SampleTable(track, timescale, offsets, sizes, times, durations)
+
+    def readRequired(self, index, box, name, track):
+        "payload of the box of the gpmd trak, which a readable file can't be without"
+        if box is None:
+            raise Exception("Box %s of the gpmd track %d not found" % (name, track))
+        return index.read(box)
+
+    def readSizes(self, stsz):
+        sample_size, count = struct.unpack_from('>II', stsz, 4)
+        if sample_size:
+            return (sample_size,) * count
+        return struct.unpack_from('>%dI' % count, stsz, 12)
+
+    def readOffsets(self, stsc, chunks, sizes):
+        """
+        Expands the sample-to-chunk runs into one absolute offset per sample.
+        Each stsc entry is (first_chunk, samples_per_chunk, description) and
+        holds until the first_chunk of the next entry.
+        """
+        count, = struct.unpack_from('>I', stsc, 4)
+        entries = list(struct.iter_unpack('>III', stsc[8:8 + count * 12]))
+
+        offsets = []
+        sample = 0
+        for i, (first_chunk, per_chunk, _) in enumerate(entries):
+            last_chunk = entries[i + 1][0] - 1 if i + 1 < len(entries) else len(chunks)
+            for chunk in range(first_chunk - 1, last_chunk):
+                offset = chunks[chunk]
+                for size in sizes[sample:sample + per_chunk]:
+                    offsets.append(offset)
+                    offset += size
+                sample += per_chunk
+        return offsets[:len(sizes)]
+
+    def readTimes(self, stts, timescale, total):
+        "start time and duration in seconds of every sample"
+        count, = struct.unpack_from('>I', stts, 4)
+        times = []
+        durations = []
+        tick = 0
+        for samples, delta in struct.iter_unpack('>II', stts[8:8 + count * 8]):
+            for _ in range(samples):
+                times.append(tick / timescale)
+                durations.append(delta / timescale)
+                tick += delta
+        return times[:total], durations[:total]
+
+    def payloadRange(self, track, start=None, end=None):
+        """
+        (first, last) indexes of the payloads of the track overlapping the
+        time range [start, end) in seconds, last excluded. None leaves that
+        side of the range open.
+        """
+        first = 0
+        last = len(track.times)
+        if start is not None:
+            first = max(0, bisect.bisect_right(track.times, start) - 1)
+            if first < last and track.times[first] + track.durations[first] <= start:
+                first += 1
+        if end is not None:
+            last = max(first, bisect.bisect_left(track.times, end))
+        return first, last
+
+    def getMetadata(self, track, fname, payloads=None):
+        """
+        Reads the payloads listed in the SampleTable and returns them joined,
+        the same bytes ffmpeg -codec copy -f rawvideo would have produced.
+        Contiguous payloads are copied in one go; only their pages are read.
+        payloads (indexes, in order) limits the read to those, e.g. the range
+        from payloadRange.
+        """
+        if payloads is None:
+            payloads = range(len(track.sizes))
+
+        chunks = []
+        start = None
+        end = None
+        with open_mmap(fname) as f:
+            for i in payloads:
+                offset = track.offsets[i]
+                if offset != end:
+                    if start is not None:
+                        chunks.append(bytes(f[start:end]))
+                    start = offset
+                end = offset + track.sizes[i]
+            if start is not None:
+                chunks.append(bytes(f[start:end]))
+        return b''.join(chunks)
@@ -0,0 +1,233 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import sys
+import array
+import collections
+import struct
+import operator
+import json
+
+# Columnar file written by dump_columns, little-endian:
+#   header   magic, version, offset of the layout document
+#   columns  one contiguous array per column, 8 byte aligned
+#   layout   json: sample count, the columns (name, dtype, offset, count), the
+#            SCAL values and the rest of the document
+columns_magic = b'G2JC'
+columns_version = 1
+columns_header = struct.Struct('<4sH2xQ')
+
+# array typecode -> numpy dtype of the column in the file
+column_dtypes = {'q': '<i8', 'd': '<f8', 'I': '<u4', 'B': '|u1'}
+
+
+class StreamColumns:
+    """
+    One stream of a SampleStore: a contiguous array per axis, aligned with
+    the samples of the store, and a presence flag per sample since a frame
+    doesn't carry every stream.
+    """
+    def __init__(self, axes, typecode, length=0):
+        self.axes = axes
+        self.typecode = typecode
+        self.present = bytearray(length)
+        self.columns = [array.array(typecode, bytes(length * array.array(typecode).itemsize)) for _ in axes]
+
+    def grow(self):
+        self.present.append(0)
+        for column in self.columns:
+            column.append(0)
+
+    def set(self, i, values):
+        self.present[i] = 1
+        for column, value in zip(self.columns, values):
+            column[i] = value
+
+    def negate(self, axis):
+        "flip the polarity of a whole axis"
+        i = self.axes.index(axis)
+        self.columns[i] = array.array(self.typecode, map(operator.neg, self.columns[i]))
+
+    def row(self, i):
+        return dict(zip(self.axes, (column[i] for column in self.columns)))
+
+
+class SampleStore:
+    """
+    Columnar container for the samples of Build360Points: CTS and VPTS
+    arrays, an index into the distinct SCAL values, and a StreamColumns per
+    FourCC. Serializers read it row by row with rows().
+    """
+    def __init__(self):
+        self.cts = array.array('q')
+        self.vpts = array.array('q')
+        self.has_vpts = bytearray()
+        self.scal = array.array('I')
+        self.scales = []
+        # every payload decodes its own SCAL, the same values are kept once
+        self.scale_index = {}
+        self.streams = {}
+
+    def __len__(self):
+        return len(self.cts)
+
+    def append(self, CTS, VPTS, SCAL):
+        "new sample (frame), returns its index"
+        # by repr, 1 and 1.0 don't write the same JSON
+        key = repr(SCAL)
+        scale = self.scale_index.get(key)
+        if scale is None:
+            scale = self.scale_index[key] = len(self.scales)
+            self.scales.append(SCAL)
+        self.cts.append(CTS)
+        self.vpts.append(VPTS or 0)
+        self.has_vpts.append(VPTS is not None)
+        self.scal.append(scale)
+        for stream in self.streams.values():
+            stream.grow()
+        return len(self.cts) - 1
+
+    def set(self, i, fourCC, data, typecode='d'):
+        "store the namedtuple data as the fourCC reading of sample i"
+        stream = self.streams.get(fourCC)
+        if stream is None:
+            stream = self.streams[fourCC] = StreamColumns(data._fields, typecode, len(self.cts))
+        stream.set(i, data)
+
+    def intervals(self):
+        "VPTS difference between consecutive samples, missing VPTS count as 0"
+        return list(map(operator.sub, self.vpts[1:], self.vpts[:-1]))
+
+    def row(self, i):
+        sample = {
+            'CTS': self.cts[i],
+            'VPTS': self.vpts[i] if self.has_vpts[i] else None,
+            'SCAL': self.scales[self.scal[i]]
+        }
+        for fourCC, stream in self.streams.items():
+            if stream.present[i]:
+                sample[fourCC] = stream.row(i)
+        return sample
+
+    def rows(self):
+        "the samples as dicts, one at a time"
+        for i in range(len(self.cts)):
+            yield self.row(i)
+
+
+def to_json(obj):
+    "json.dumps default= hook, writes a SampleStore as its list of samples"
+    if isinstance(obj, SampleStore):
+        return list(obj.rows())
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def dump(obj, fd, block=1000):
+    """
+    Like json.dump(obj, fd, default=to_json), but a SampleStore is written
+    block by block straight from its columns, so neither the list of
+    samples nor the whole document is ever built in memory.
+    """
+    if isinstance(obj, SampleStore):
+        fd.write('[')
+        rows = []
+        first = True
+        for row in obj.rows():
+            rows.append(json.dumps(row))
+            if len(rows) == block:
+                fd.write(('' if first else ', ') + ', '.join(rows))
+                first = False
+                rows = []
+        if rows:
+            fd.write(('' if first else ', ') + ', '.join(rows))
+        fd.write(']')
+    elif isinstance(obj, dict):
+        fd.write('{')
+        for i, (key, value) in enumerate(obj.items()):
+            if i:
+                fd.write(', ')
+            fd.write(json.dumps(str(key)) + ': ')
+            dump(value, fd, block)
+        fd.write('}')
+    else:
+        fd.write(json.dumps(obj, default=to_json))
+
+
+def dump_columns(samples, fd, document=None):
+    """
+    Writes the SampleStore samples to the binary file fd as contiguous
+    little-endian columns: CTS and VPTS (int64, VPTS.present flags), SCAL
+    (uint32 index into the layout's scales) and per stream a present flag
+    column and a float64 column per axis, e.g. CORI.w. document is the rest
+    of the output (camera, date, anchors...), kept in the layout as is.
+
+    Every column is a plain array at a known offset, so with numpy:
+
+        column = layout['columns']['CORI.w']
+        numpy.memmap(path, dtype=column['dtype'], mode='r',
+                     offset=column['offset'], shape=(column['count'],))
+    """
+    columns = [
+        ('CTS', samples.cts),
+        ('VPTS', samples.vpts),
+        ('VPTS.present', array.array('B', samples.has_vpts)),
+        ('SCAL', samples.scal)
+    ]
+    for fourCC, stream in samples.streams.items():
+        columns.append(('%s.present' % fourCC, array.array('B', stream.present)))
+        for axis, column in zip(stream.axes, stream.columns):
+            if column.typecode != 'd':
+                column = array.array('d', column)
+            columns.append(('%s.%s' % (fourCC, axis), column))
+
+    fd.write(columns_header.pack(columns_magic, columns_version, 0))
+    offset = columns_header.size
+    layout = collections.OrderedDict()
+    for name, column in columns:
+        if sys.byteorder == 'big':
+            column = array.array(column.typecode, column)
+            column.byteswap()
+        data = column.tobytes()
+        layout[name] = {'dtype': column_dtypes[column.typecode], 'offset': offset, 'count': len(column)}
+        fd.write(data)
+        offset += len(data)
+        if offset % 8:
+            fd.write(bytes(8 - offset % 8))
+            offset += 8 - offset % 8
+
+    fd.write(json.dumps({
+        'samples': len(samples),
+        'columns': layout,
+        'scales': samples.scales,
+        'document': document
+    }).encode('utf-8'))
+    fd.seek(0)
+    fd.write(columns_header.pack(columns_magic, columns_version, offset))
+
+
+def load_columns(path):
+    """
+    Reads a file written by dump_columns without numpy: returns the layout
+    and a dict of arrays by column name.
+    """
+    with open(path, 'rb') as fd:
+        data = fd.read()
+    magic, version, offset = columns_header.unpack_from(data, 0)
+    if magic != columns_magic or version != columns_version:
+        raise Exception("%s is not a columnar gopro2json file" % path)
+    layout = json.loads(data[offset:].decode('utf-8'))
+
+    typecodes = dict((v, k) for k, v in column_dtypes.items())
+    columns = {}
+    for name, column in layout['columns'].items():
+        values = array.array(typecodes[column['dtype']])
+        start = column['offset']
+        values.frombytes(data[start:start + column['count'] * values.itemsize])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        columns[name] = values
+    return layout, columns
@@ -0,0 +1,206 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Times the stages of the conversion on gpmd dumps, by default the ones in
+# samples/, each also concatenated into longer synthetic recordings:
+#
+#   % python test/benchmark.py -o before.json
+#   % python test/benchmark.py -o after.json --compare before.json
+#
+# Every stage is run --repeat times and the best time is kept. Throughput is
+# given in MB/s of its input and in items/s (KLVs, samples or points; a
+# string label counts a sample per string, not per character).
+#
+# The bundled samples come from cameras writing no VPTS, which
+# Build360Points needs; the 360 stages get a copy with a VPTS added to every
+# DEVC (with_vpts). Any error fails the run.
+#
+
+import os
+import io
+import sys
+import glob
+import json
+import time
+import struct
+import platform
+import argparse
+from collections import OrderedDict
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gopro2json import config
+from gopro2json import gpmf
+from gopro2json import fourCC
+from gopro2json import gpshelper
+from gopro2json import samplestore
+from gopro2json.klvdata import KLVData
+from gopro2json.gopro2json import Build360Points, BuildGPSPoints
+
+samples_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'samples')
+
+
+def best(repeat, function, *args):
+    "the shortest of repeat runs of function in seconds, and its result"
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    return seconds, result
+
+
+def result(name, copies, stage, seconds, nbytes, items, unit):
+    return OrderedDict([
+        ('sample', name),
+        ('copies', copies),
+        ('stage', stage),
+        ('seconds', seconds),
+        ('bytes', nbytes),
+        ('items', items),
+        ('unit', unit),
+        ('MB/s', nbytes / seconds / 1e6 if seconds else None),
+        ('items/s', items / seconds if seconds else None)
+    ])
+
+
+def with_vpts(data, step=1001000):
+    """
+    data with a VPTS (microseconds, uint64) as the first KLV of every DEVC,
+    step apart, like the MAX writes one per payload.
+    """
+    chunks = []
+    offset = 0
+    vpts = 0
+    while offset < len(data):
+        key, type, size, repeat = KLVData.header.unpack_from(data, offset)
+        length = (size * repeat + 3) & ~3
+        if key == b'DEVC':
+            klv = KLVData.header.pack(b'VPTS', ord('J'), 8, 1) + struct.pack('>Q', vpts)
+            chunks.append(KLVData.header.pack(key, type, size, repeat + len(klv) // size))
+            chunks.append(klv)
+            chunks.append(data[offset + 8:offset + 8 + length])
+            vpts += step
+        else:
+            chunks.append(data[offset:offset + 8 + length])
+        offset += 8 + length
+    return b''.join(chunks)
+
+
+def samples(klv):
+    """
+    samples in the payload of klv: repeat, but for a string of single
+    characters (STNM, TYPE, DVNM...) where it counts the characters of the
+    one string
+    """
+    if chr(klv.type) in 'cU' and klv.size == 1:
+        return 1
+    return klv.repeat
+
+
+def decode(klvs):
+    for klv in klvs:
+        fourCC.Manage(klv)
+
+
+def write_text(writer, points):
+    fd = io.StringIO()
+    writer(points, fd)
+    return fd.getvalue()
+
+
+def run_sample(name, data, copies, repeat):
+    "the results of every stage on data repeated copies times"
+    results = []
+    data = data * copies
+    parser = gpmf.Parser(config.setup_environment())
+
+    seconds, klvs = best(repeat, parser.parseStream, data)
+    results.append(result(name, copies, 'parseStream', seconds, len(data), len(klvs), 'KLVs'))
+
+    labels = OrderedDict()
+    for klv in klvs:
+        if klv.type != 0 and klv.fourCC in fourCC.decoders:
+            labels.setdefault(klv.fourCC, []).append(klv)
+    for label, group in labels.items():
+        seconds, _ = best(repeat, decode, group)
+        results.append(result(name, copies, 'decode %s' % label, seconds,
+            sum(klv.length for klv in group), sum(samples(klv) for klv in group), 'samples'))
+
+    seconds, points = best(repeat, BuildGPSPoints, klvs)
+    results.append(result(name, copies, 'BuildGPSPoints', seconds, len(data), len(points), 'points'))
+    if len(points):
+        for stage, writer in (('write_GPX', gpshelper.write_GPX), ('write_KML', gpshelper.write_KML)):
+            seconds, text = best(repeat, write_text, writer, points)
+            results.append(result(name, copies, stage, seconds, len(text), len(points), 'points'))
+
+    if not any(klv.fourCC == 'VPTS' for klv in klvs):
+        data = with_vpts(data)
+        klvs = parser.parseStream(data)
+    seconds, streams = best(repeat, Build360Points, klvs)
+    count = len(streams['streams']['samples'])
+    results.append(result(name, copies, 'Build360Points', seconds, len(data), count, 'samples'))
+    seconds, text = best(repeat, write_text, samplestore.dump, streams)
+    results.append(result(name, copies, 'samplestore.dump', seconds, len(text), count, 'samples'))
+
+    return results
+
+
+def print_results(results, previous=None):
+    "a line per stage, with the speedup against the previous run when given"
+    before = {}
+    for r in previous or []:
+        if 'seconds' in r:
+            before[(r['sample'], r['copies'], r['stage'])] = r['seconds']
+
+    for r in results:
+        line = "%-16s x%-4d %-22s %10.3f ms %9.2f MB/s %12.0f %s/s" % (r['sample'], r['copies'], r['stage'],
+            r['seconds'] * 1000, r['MB/s'], r['items/s'], r['unit'])
+        seconds = before.get((r['sample'], r['copies'], r['stage']))
+        if seconds:
+            line += "  %5.2fx" % (seconds / r['seconds'])
+        print(line)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeat", help="runs of every stage, the best one is kept", type=int, default=5)
+    parser.add_argument("-n", "--copies", help="also time every sample concatenated these many times, e.g. 10,100 (none with '')", default="10,100")
+    parser.add_argument("-o", "--output", help="save the results as JSON", default=None)
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against", default=None)
+    parser.add_argument("file", help="gpmd dumps, samples/*.bin by default", nargs="*")
+    args = parser.parse_args()
+
+    files = args.file or sorted(glob.glob(os.path.join(samples_dir, '*.bin')))
+    previous = None
+    if args.compare:
+        with open(args.compare) as fd:
+            previous = json.load(fd)['results']
+
+    results = []
+    for f in files:
+        with open(f, 'rb') as fd:
+            data = fd.read()
+        name = os.path.splitext(os.path.basename(f))[0]
+        for copies in [1] + [int(n) for n in args.copies.split(',') if n]:
+            results.extend(run_sample(name, data, copies, args.repeat))
+
+    print_results(results, previous)
+
+    if args.output:
+        report = OrderedDict([
+            ('date', datetime.now().isoformat()),
+            ('python', sys.version),
+            ('platform', platform.platform()),
+            ('repeat', args.repeat),
+            ('results', results)
+        ])
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
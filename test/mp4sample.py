@@ -0,0 +1,103 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Builds the smallest MP4 the tests need around a gpmd dump: a video trak
+# without samples, then the gpmd trak, its payloads in chunks separated by
+# filler standing for the video.
+#
+
+import os
+import struct
+
+samples_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'samples')
+
+# ticks per payload and timescale of the gpmd trak
+duration = 1001
+timescale = 1000
+
+
+def sample(name):
+    "path of the bundled samples/<name>.bin"
+    return os.path.join(samples_dir, '%s.bin' % name)
+
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+def full_box(kind, payload, version=0):
+    return box(kind, bytes([version, 0, 0, 0]) + payload)
+
+
+def klv(key, type, payload, size=None, repeat=1):
+    "a GPMF KLV, payload padded to 4 bytes; type 0 for a container"
+    if size is None:
+        size = len(payload) // repeat if payload else 0
+    return struct.pack('>4sBBH', key, type, size, repeat) + payload + bytes(-len(payload) % 4)
+
+
+def payloads(data):
+    "the top level KLVs (DEVC) of the dump, one per gpmd sample"
+    items = []
+    offset = 0
+    while offset < len(data):
+        key, type, size, repeat = struct.unpack_from('>4sBBH', data, offset)
+        length = 8 + ((size * repeat + 3) & ~3)
+        items.append(data[offset:offset + length])
+        offset += length
+    return items
+
+
+def build(data, path, per_chunk=3, co64=False, largesize=False, gpmf=None):
+    """
+    Writes the MP4 to path and returns the payloads. per_chunk payloads go in
+    every chunk, the last one holds the rest (a second stsc run). co64 uses
+    64-bit chunk offsets, largesize the 64-bit form of the mdat size. gpmf is
+    the content of a moov/udta/GPMF box (highlights), None for no udta.
+    """
+    items = payloads(data)
+    ftyp = box(b'ftyp', b'mp41\0\0\0\0mp41')
+    start = len(ftyp) + (16 if largesize else 8)
+
+    mdat = bytearray()
+    chunks = []
+    for i in range(0, len(items), per_chunk):
+        mdat += b'\xaa' * 37
+        chunks.append(start + len(mdat))
+        for item in items[i:i + per_chunk]:
+            mdat += item
+    if largesize:
+        mdat = struct.pack('>I4sQ', 1, b'mdat', 16 + len(mdat)) + bytes(mdat)
+    else:
+        mdat = box(b'mdat', bytes(mdat))
+
+    runs = [(1, per_chunk, 1)]
+    last = len(items) - per_chunk * (len(chunks) - 1)
+    if last != per_chunk:
+        runs.append((len(chunks), last, 1))
+    stsc = full_box(b'stsc', struct.pack('>I', len(runs)) + b''.join(struct.pack('>III', *r) for r in runs))
+    sizes = [len(item) for item in items]
+    stsz = full_box(b'stsz', struct.pack('>II', 0, len(sizes)) + struct.pack('>%dI' % len(sizes), *sizes))
+    if co64:
+        stco = full_box(b'co64', struct.pack('>I', len(chunks)) + struct.pack('>%dQ' % len(chunks), *chunks))
+    else:
+        stco = full_box(b'stco', struct.pack('>I', len(chunks)) + struct.pack('>%dI' % len(chunks), *chunks))
+    stts = full_box(b'stts', struct.pack('>III', 1, len(sizes), duration))
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + box(b'gpmd', bytes(8)))
+    mdhd = full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, duration * len(sizes)) + bytes(4))
+
+    minf = box(b'minf', box(b'gmhd', b'') + box(b'stbl', stsd + stts + stsc + stsz + stco))
+    hdlr = full_box(b'hdlr', b'\0\0\0\0meta' + bytes(12) + b'GoPro MET\0')
+    trak = box(b'trak', box(b'tkhd', bytes(84)) + box(b'mdia', mdhd + hdlr + minf))
+
+    video_stsd = full_box(b'stsd', struct.pack('>I', 1) + box(b'avc1', bytes(8)))
+    video_hdlr = full_box(b'hdlr', b'\0\0\0\0vide' + bytes(13))
+    video = box(b'trak', box(b'mdia', mdhd + video_hdlr + box(b'minf', box(b'stbl', video_stsd))))
+
+    udta = b'' if gpmf is None else box(b'udta', box(b'GPMF', gpmf))
+    moov = box(b'moov', box(b'mvhd', bytes(100)) + video + trak + udta)
+    with open(path, 'wb') as fd:
+        fd.write(ftyp + mdat + moov)
+    return items
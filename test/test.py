@@ -8,15 +8,19 @@ if __name__ == "__main__":
     # parser.add_argument("-v", "--verbose", help="increase output verbosity", action="count")
     # parser.add_argument("-b", "--binary", help="read data from bin file", action="store_true")
     # parser.add_argument("-s", "--skip", help="Skip bad points (GPSFIX=0)", action="store_true", default=False)
-    parser.add_argument("file", help="Video file or binary metadata dump")
+    parser.add_argument("-c", "--cache", help="keep extracted and parsed files in this directory for the next runs", default=None)
+    parser.add_argument("-i", "--index", help="write a .gpmi index next to the output and use it on the next runs", action="store_true")
+    parser.add_argument("--columns", help="also write the samples as a columnar binary file (.cols)", action="store_true")
+    parser.add_argument("-j", "--jobs", help="read the files in parallel with this many processes", type=int, default=None)
+    parser.add_argument("file", help="Video file or binary metadata dump. Chapters of the same recording in order.", nargs="+")
     args = parser.parse_args()
 
-    inFile = args.file
-    outFile, ext = os.path.splitext(args.file)
+    inFiles = args.file
+    outFile, ext = os.path.splitext(args.file[0])
     outFile = outFile + '.transform.json'
 
     try:
-        gopro2json.Parse360ToJson([inFile], outFile)
+        gopro2json.Parse360ToJson(inFiles, outFile, workers=args.jobs, cache=args.cache, index=args.index, columns=args.columns)
     except Exception as error:
         print('We should be processing timelapse items only! {}'.format(error))
 
@@ -0,0 +1,150 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Run from the repository root: python -m unittest discover test
+#
+
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gopro2json.batch import Session, JobResult, find_sessions, run_sessions, report
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return path
+
+def alive(pid):
+    "whether pid runs, a zombie waiting for its parent being dead"
+    try:
+        with open('/proc/%d/stat' % pid) as fd:
+            return fd.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class FindSessionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, *names):
+        return os.path.join(self.dir, *names)
+
+    def test_chapters(self):
+        for name in ('GH020001.MP4', 'GH010001.MP4', 'GX010002.MP4', 'GOPR0003.MP4', 'GP010003.MP4',
+                'GS010004.360', 'README.txt', 'GH010001.THM'):
+            touch(self.path('DCIM', '100GOPRO', name))
+        touch(self.path('DCIM', '101GOPRO', 'GH010001.MP4'))
+
+        sessions = find_sessions([self.dir])
+        self.assertEqual([(s.name, [os.path.relpath(f, self.dir) for f in s.files]) for s in sessions], [
+            ('GH010001', [os.path.join('DCIM', '100GOPRO', 'GH010001.MP4'), os.path.join('DCIM', '100GOPRO', 'GH020001.MP4')]),
+            ('GOPR0003', [os.path.join('DCIM', '100GOPRO', 'GOPR0003.MP4'), os.path.join('DCIM', '100GOPRO', 'GP010003.MP4')]),
+            ('GS010004', [os.path.join('DCIM', '100GOPRO', 'GS010004.360')]),
+            ('GX010002', [os.path.join('DCIM', '100GOPRO', 'GX010002.MP4')]),
+            ('GH010001', [os.path.join('DCIM', '101GOPRO', 'GH010001.MP4')]),
+        ])
+        self.assertEqual(sessions[0].output, self.path('DCIM', '100GOPRO', 'GH010001.json'))
+
+    def test_outputdir(self):
+        touch(self.path('card', 'DCIM', '100GOPRO', 'GH010001.MP4'))
+        touch(self.path('card', 'DCIM', '101GOPRO', 'GH010001.MP4'))
+        out = self.path('out')
+        self.assertEqual([s.output for s in find_sessions([self.path('card')], out)], [
+            os.path.join(out, 'DCIM', '100GOPRO', 'GH010001.json'),
+            os.path.join(out, 'DCIM', '101GOPRO', 'GH010001.json'),
+        ])
+        # a file given alone goes straight under outputdir
+        f = self.path('card', 'DCIM', '100GOPRO', 'GH010001.MP4')
+        self.assertEqual([s.output for s in find_sessions([f], out)], [os.path.join(out, 'GH010001.json')])
+
+
+class RunSessionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.environ = os.environ.get('FFPROBE_PATH')
+
+    def tearDown(self):
+        if self.environ is None:
+            os.environ.pop('FFPROBE_PATH', None)
+        else:
+            os.environ['FFPROBE_PATH'] = self.environ
+        shutil.rmtree(self.dir)
+
+    def test_failed(self):
+        missing = os.path.join(self.dir, 'GH010001.MP4')
+        results = run_sessions([Session('GH010001', [missing], os.path.join(self.dir, 'GH010001.json'))])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].status, 'failed')
+        self.assertIn('FileNotFoundError', results[0].error)
+
+    @unittest.skipUnless(hasattr(os, 'killpg'), 'process groups')
+    def test_timeout(self):
+        # an ffprobe that hangs, run for the files without a gpmd track by
+        # each of the chapter workers
+        pids = os.path.join(self.dir, 'pids')
+        ffprobe = os.path.join(self.dir, 'ffprobe')
+        with open(ffprobe, 'w') as fd:
+            fd.write('#!/bin/sh\necho $$ $PPID >> %s\nsleep 30\n' % pids)
+        os.chmod(ffprobe, 0o755)
+        os.environ['FFPROBE_PATH'] = ffprobe
+
+        files = [touch(os.path.join(self.dir, name)) for name in ('GS010001.360', 'GS020001.360')]
+        started = time.time()
+        results = run_sessions([Session('GS010001', files, os.path.join(self.dir, 'GS010001.json'))],
+            timeout=1, workers=2)
+        self.assertEqual([r.status for r in results], ['timeout'])
+        self.assertLess(time.time() - started, 15)
+
+        with open(pids) as fd:
+            started = set(int(pid) for pid in fd.read().split())
+        self.assertGreater(len(started), 0)
+        deadline = time.time() + 5
+        while any(alive(pid) for pid in started) and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual([pid for pid in started if alive(pid)], [])
+
+
+class ReportTest(unittest.TestCase):
+
+    def test_report(self):
+        results = [
+            JobResult(Session('GH010001', ['GH010001.MP4'], 'GH010001.json'), 'ok', None, 1.5),
+            JobResult(Session('GH010002', ['GH010002.MP4'], 'GH010002.json'), 'failed', 'OSError: no', 0.25),
+            JobResult(Session('GH010003', ['GH010003.MP4'], 'GH010003.json'), 'timeout', 'timed out after 1s', 1.0),
+        ]
+        fd = io.StringIO()
+        report(results, fd)
+        lines = fd.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0].split(), ['ok', 'GH010001', '1.50s', 'GH010001.json'])
+        self.assertTrue(lines[1].endswith('GH010002.json (OSError: no)'))
+        self.assertTrue(lines[2].startswith('timeout'))
+        self.assertEqual(lines[3], '3 sessions: 1 ok, 1 failed, 1 timeout, 2.75s')
+
+
+if __name__ == '__main__':
+    unittest.main()
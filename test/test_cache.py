@@ -0,0 +1,113 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Run from the repository root: python -m unittest discover test
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gopro2json.cache import Cache
+
+
+class CountingCache(Cache):
+    "counts the directory listings"
+    evictions = 0
+
+    def evict(self):
+        self.evictions += 1
+        Cache.evict(self)
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'GH010001.MP4')
+        with open(self.source, 'wb') as fd:
+            fd.write(b'\0' * 16)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def cache(self, max_size=1 << 30):
+        return CountingCache(os.path.join(self.directory, 'cache'), max_size)
+
+    def entries(self, cache):
+        return sorted(os.listdir(cache.directory))
+
+    def test_put_get(self):
+        cache = self.cache()
+        key = cache.key(self.source)
+        self.assertIsNone(cache.get(key, 'gpmd'))
+        cache.put(key, 'gpmd', b'DEVC')
+        self.assertEqual(cache.get(key, 'gpmd'), b'DEVC')
+        self.assertIsNone(cache.get(key, 'recording'))
+
+        cache.putObject(key, 'recording', {'fps': 29.97, 'klvs': [1, 2]})
+        self.assertEqual(cache.getObject(key, 'recording'), {'fps': 29.97, 'klvs': [1, 2]})
+        # not a pickle: a miss
+        cache.put(key, 'recording', b'DEVC')
+        self.assertIsNone(cache.getObject(key, 'recording'))
+
+    def test_key(self):
+        cache = self.cache()
+        key = cache.key(self.source)
+        self.assertEqual(cache.key(self.source), key)
+        self.assertNotEqual(cache.key(self.source, ('GPS5',)), key)
+        with open(self.source, 'ab') as fd:
+            fd.write(b'\0')
+        self.assertNotEqual(cache.key(self.source), key)
+
+    def test_failed_put(self):
+        cache = self.cache()
+        with self.assertRaises(TypeError):
+            cache.put('a', 'gpmd', object())
+        self.assertEqual(self.entries(cache), [])
+
+    def test_eviction(self):
+        cache = self.cache(max_size=250)
+        for i, name in enumerate('abc'):
+            cache.put(name, 'gpmd', bytes(100))
+            # one second apart, the order of use
+            os.utime(cache.path(name, 'gpmd'), (1000 + i, 1000 + i))
+        self.assertEqual(self.entries(cache), ['b.gpmd', 'c.gpmd'])
+        self.assertEqual(cache.size, 200)
+
+        # a hit makes b the most recently used, c goes next
+        self.assertIsNotNone(cache.get('b', 'gpmd'))
+        cache.put('d', 'gpmd', bytes(100))
+        self.assertEqual(self.entries(cache), ['b.gpmd', 'd.gpmd'])
+        self.assertEqual(cache.size, 200)
+
+    def test_size(self):
+        "the directory is listed on the first put and then only when the running size goes over"
+        cache = self.cache(max_size=1000)
+        cache.put('a', 'gpmd', bytes(100))
+        self.assertEqual((cache.size, cache.evictions), (100, 1))
+        for name in 'bcdefgh':
+            cache.put(name, 'gpmd', bytes(100))
+        self.assertEqual((cache.size, cache.evictions), (800, 1))
+        cache.put('i', 'gpmd', bytes(300))
+        self.assertEqual(cache.evictions, 2)
+        self.assertLessEqual(cache.size, 1000)
+        self.assertEqual(cache.size, sum(os.path.getsize(cache.path(name, 'gpmd'))
+            for name in 'abcdefghi' if os.path.exists(cache.path(name, 'gpmd'))))
+
+        # a new Cache on the same directory starts from a listing
+        cache = self.cache(max_size=1000)
+        cache.put('j', 'gpmd', bytes(10))
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.size, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Run from the repository root: python -m unittest discover test
+#
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gopro2json import config
+from gopro2json import ffmpegtools
+from gopro2json.ffmpegtools import FFMpegTools, ProbeResult
+
+# ffprobe -v error -show_format -show_streams -show_chapters -of json of a
+# GoPro MAX chapter, cut down to what parseProbe reads
+probe_json = '''{
+    "streams": [
+        { "index": 0, "codec_type": "video", "r_frame_rate": "30000/1001", "duration": "6.173500",
+          "tags": { "creation_time": "2020-07-10T16:28:24.000000Z", "handler_name": "GoPro H.265" } },
+        { "index": 1, "codec_type": "audio", "duration": "6.165333" },
+        { "index": 3, "codec_type": "data", "codec_tag_string": "gpmd",
+          "tags": { "creation_time": "2020-07-10T16:28:24.000000Z", "handler_name": "GoPro MET" } }
+    ],
+    "chapters": [
+        { "id": 0, "start_time": "0.000000", "end_time": "3.003000" },
+        { "id": 1, "start_time": "3.003000", "end_time": "6.173500" }
+    ],
+    "format": { "duration": "6.180000", "tags": { "creation_time": "2020-07-10T16:28:24.000000Z" } }
+}'''
+
+
+class CountingTools(FFMpegTools):
+    "runs no ffprobe, answers with the documents given, in turn"
+    def __init__(self, documents):
+        FFMpegTools.__init__(self, config.setup_environment())
+        self.documents = list(documents)
+        self.runs = 0
+
+    def runProbe(self, fname):
+        self.runs += 1
+        return self.documents.pop(0)
+
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file = os.path.join(self.directory, 'GS010001.360')
+        with open(self.file, 'wb') as fd:
+            fd.write(b'\0' * 64)
+        ffmpegtools.probe_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        ffmpegtools.probe_cache.clear()
+
+    def test_parse(self):
+        result = FFMpegTools(config.setup_environment()).parseProbe(json.loads(probe_json))
+        self.assertEqual(result, ProbeResult('2020-07-10T16:28:24.000000Z', 6.1735, 30000 / 1001,
+            [{'start': 0.0, 'end': 3.003}, {'start': 3.003, 'end': 6.1735}], (3, 'Stream #0:3: Data: GoPro MET (gpmd)')))
+
+    def test_parse_empty(self):
+        tools = FFMpegTools(config.setup_environment())
+        self.assertEqual(tools.parseProbe({}), ProbeResult('', 0.0, 0.0, [], None))
+        # no video stream: the format duration, no rate
+        info = json.loads(probe_json)
+        info['streams'] = info['streams'][2:]
+        result = tools.parseProbe(info)
+        self.assertEqual((result.date, result.duration, result.fps), ('2020-07-10T16:28:24.000000Z', 6.18, 0.0))
+
+    def test_cached(self):
+        tools = CountingTools([json.loads(probe_json)])
+        self.assertEqual(tools.probe(self.file).duration, 6.1735)
+        self.assertEqual(tools.getChapters(self.file)[1]['end'], 6.1735)
+        self.assertEqual(tools.runs, 1)
+
+        # a changed file is probed again
+        with open(self.file, 'ab') as fd:
+            fd.write(b'\0')
+        tools.documents.append(None)
+        self.assertEqual(tools.probe(self.file).duration, 0.0)
+        self.assertEqual(tools.runs, 2)
+
+    def test_failure_not_cached(self):
+        tools = CountingTools([None, None, json.loads(probe_json)])
+        self.assertEqual(tools.probe(self.file), ProbeResult('', 0.0, 0.0, [], None))
+        self.assertEqual(tools.probe(self.file).duration, 0.0)
+        self.assertEqual(tools.probe(self.file).duration, 6.1735)
+        self.assertEqual(tools.probe(self.file).duration, 6.1735)
+        self.assertEqual(tools.runs, 3)
+
+    def test_bounded(self):
+        tools = CountingTools([json.loads(probe_json)] * 3)
+        size = ffmpegtools.probe_cache_size
+        ffmpegtools.probe_cache_size = 2
+        try:
+            files = [self.file + str(i) for i in range(3)]
+            for f in files:
+                shutil.copy(self.file, f)
+                tools.probe(f)
+            self.assertEqual(len(ffmpegtools.probe_cache), 2)
+            self.assertEqual([key[0] for key in ffmpegtools.probe_cache], [os.path.abspath(f) for f in files[1:]])
+        finally:
+            ffmpegtools.probe_cache_size = size
+
+
+if __name__ == '__main__':
+    unittest.main()
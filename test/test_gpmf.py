@@ -0,0 +1,164 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Run from the repository root: python -m unittest discover test
+#
+
+import io
+import os
+import sys
+import glob
+import unittest
+import contextlib
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gopro2json import config
+from gopro2json import gpmf
+from gopro2json import gpshelper
+from gopro2json import gpmftree
+from gopro2json.gopro2json import BuildGPSPoints
+from gopro2json.gpmfindex import payload_streams
+
+samples_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'samples')
+samples = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'samples', '*.bin')))
+
+
+def columns(track):
+    return [list(getattr(track, name)) for name in ('latitude', 'longitude', 'elevation', 'time', 'speed')]
+
+def context(metadata):
+    "the labels decoded under any filter (STNM, SCAL, SIUN...)"
+    return repr(dict((k, v) for k, v in metadata.items() if k in gpmftree.context_labels))
+
+
+class FourCCFilterTest(unittest.TestCase):
+    "Parser(fourccs=...) gives what the full parse gives for those streams"
+
+    def test_gps_points(self):
+        for f in samples:
+            with self.subTest(sample=os.path.basename(f)):
+                cfg = config.setup_environment(f, binary=True)
+                full = BuildGPSPoints(gpmf.Parser(cfg).readFromBinary())
+                filtered = BuildGPSPoints(gpmf.Parser(cfg, fourccs=['GPS5']).readFromBinary())
+                self.assertGreater(len(full), 0)
+                self.assertEqual(columns(full), columns(filtered))
+
+    def test_gps_tree(self):
+        for f in samples:
+            with self.subTest(sample=os.path.basename(f)):
+                cfg = config.setup_environment(f, binary=True)
+                with open(f, 'rb') as fd:
+                    data = fd.read()
+                full = gpmf.Parser(cfg).parseTree(data)
+                filtered = gpmf.Parser(cfg, fourccs=['GPS5']).parseTree(data)
+                for label in ('GPS5', 'GPRI', 'SYST'):
+                    stream = full.stream(label)
+                    if stream is None:
+                        self.assertIsNone(filtered.stream(label))
+                        continue
+                    self.assertEqual(
+                        [repr(p.klv.data) for p in stream.payloads],
+                        [repr(p.klv.data) for p in filtered.stream(label).payloads])
+
+    def test_no_empty_streams(self):
+        for f in samples:
+            with self.subTest(sample=os.path.basename(f)):
+                cfg = config.setup_environment(f, binary=True)
+                with open(f, 'rb') as fd:
+                    data = fd.read()
+                for fourccs in (None, ['GPS5'], ['ACCL', 'GYRO'], ['CORI']):
+                    tree = gpmf.Parser(cfg, fourccs=fourccs).parseTree(data)
+                    for device in tree.devices.values():
+                        for stream in device.streams.values():
+                            self.assertGreater(len(stream.payloads), 0, '%s %s' % (fourccs, stream))
+                            if fourccs is not None:
+                                self.assertIn(stream.fourCC, gpmftree.expand_labels(fourccs))
+
+    def test_sticky_metadata(self):
+        "the metadata of a stream comes with its payloads, filtered or not"
+        for f in samples:
+            with self.subTest(sample=os.path.basename(f)):
+                cfg = config.setup_environment(f, binary=True)
+                with open(f, 'rb') as fd:
+                    data = fd.read()
+                full = gpmf.Parser(cfg).parseTree(data).stream('ACCL')
+                filtered = gpmf.Parser(cfg, fourccs=['ACCL']).parseTree(data).stream('ACCL')
+                if full is None:
+                    continue
+                self.assertEqual([context(p.metadata) for p in full.payloads], [context(p.metadata) for p in filtered.payloads])
+                self.assertIn('SCAL', filtered.payloads[0].metadata)
+
+
+class GPSPointsTest(unittest.TestCase):
+    "BuildGPSPoints on the bundled dumps, times in UTC"
+
+    def points(self, name, **options):
+        cfg = config.setup_environment(os.path.join(samples_dir, '%s.bin' % name), binary=True)
+        track = BuildGPSPoints(gpmf.Parser(cfg).readFromBinary(), **options)
+        return len(track), gpshelper.FromSeconds(track.time[0]), gpshelper.FromSeconds(track.time[-1])
+
+    def test_gopro7(self):
+        # every GPS5 sample, GPSU to GPSU; the last payload is spread over the previous one's interval
+        self.assertEqual(self.points('gopro7'),
+            (1767, datetime(2019, 2, 24, 11, 19, 55, 644000), datetime(2019, 2, 24, 11, 21, 32, 877529)))
+        # the payloads of GPSF 0 are at the end of the recording
+        self.assertEqual(self.points('gopro7', skip=True),
+            (1223, datetime(2019, 2, 24, 11, 19, 55, 644000), datetime(2019, 2, 24, 11, 21, 30, 794000)))
+        self.assertEqual(self.points('gopro7', max_dop=500)[0], 1005)
+        self.assertEqual(self.points('gopro7', max_dop=200)[0], 439)
+
+    def test_hero6(self):
+        self.assertEqual(self.points('hero6'),
+            (417, datetime(2018, 1, 24, 19, 27, 58, 674000), datetime(2018, 1, 24, 19, 28, 21, 609000)))
+        self.assertEqual(self.points('hero6', skip=True)[0], 199)
+        self.assertEqual(self.points('hero6', max_dop=500)[0], 161)
+
+    def test_karma(self):
+        # GPRI timed by SYST, in UTC (samples/karma.gpx has the local time of the machine that wrote it)
+        self.assertEqual(self.points('karma'),
+            (11, datetime(2017, 4, 17, 19, 27, 58), datetime(2017, 4, 17, 19, 28, 8)))
+        # no GPSF nor GPSP to filter on
+        self.assertEqual(self.points('karma', skip=True, max_dop=200)[0], 11)
+
+
+class TruncatedTest(unittest.TestCase):
+    "a dump cut short parses up to where it ends"
+
+    def setUp(self):
+        f = samples[0]
+        self.config = config.setup_environment(f, binary=True)
+        with open(f, 'rb') as fd:
+            self.data = fd.read()
+
+    def test_short_tail(self):
+        full = [str(klv) for klv in gpmf.Parser(self.config).parseStream(self.data)]
+        for tail in (b'\0', b'DEVC', b'DEVC\0\0\0'):
+            with self.subTest(tail=tail):
+                data = self.data + tail
+                self.assertEqual([str(klv) for klv in gpmf.Parser(self.config).parseStream(data)], full)
+                self.assertEqual(len(gpmf.Parser(self.config, fourccs=['GPS5']).parseStream(data)),
+                    len(gpmf.Parser(self.config, fourccs=['GPS5']).parseStream(self.data)))
+                self.assertEqual(gpmf.Parser(self.config).parseTree(data).payloads,
+                    gpmf.Parser(self.config).parseTree(self.data).payloads)
+                self.assertEqual(payload_streams(data, 0, len(data)), payload_streams(self.data, 0, len(self.data)))
+
+    def test_cut_payload(self):
+        # the last DEVC claims more than is left
+        data = self.data[:-13]
+        with contextlib.redirect_stdout(io.StringIO()):
+            klvs = gpmf.Parser(self.config).parseStream(data)
+            filtered = gpmf.Parser(self.config, fourccs=['GPS5']).parseStream(data)
+            tree = gpmf.Parser(self.config, fourccs=['GPS5']).parseTree(data)
+        self.assertGreater(len(klvs), 0)
+        self.assertGreater(len(filtered), 0)
+        self.assertGreater(len(tree.stream('GPS5').payloads), 0)
+        self.assertGreater(len(payload_streams(data, 0, len(data) + 64)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
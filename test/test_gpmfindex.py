@@ -0,0 +1,83 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Run from the repository root: python -m unittest discover test
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gopro2json import config
+from gopro2json import gpmf
+from gopro2json.gpmfindex import GPMFIndex, index_path
+from gopro2json.ffmpegtools import ProbeResult
+
+import mp4sample
+
+probe = ProbeResult('2019-02-24T11:19:54.000000Z', 98.0, 29.97, [{'start': 0.0, 'end': 98.0}], None)
+
+
+class GPMFIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'GX010001.MP4')
+        with open(mp4sample.sample('gopro7'), 'rb') as fd:
+            self.data = fd.read()
+        self.payloads = mp4sample.build(self.data, self.video)
+        self.config = config.setup_environment(self.video)
+        self.path = index_path(self.video, self.config.outputfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        built = gpmf.Parser(self.config).buildIndex(probe)
+        built.save(self.path)
+        index = GPMFIndex.load(self.path, self.video)
+
+        self.assertEqual(index.probe, probe)
+        self.assertEqual(index.fourccs, built.fourccs)
+        for name in ('offsets', 'sizes', 'times', 'durations'):
+            self.assertEqual(list(getattr(index.track, name)), list(getattr(built.track, name)))
+        self.assertEqual(list(index.masks), list(built.masks))
+
+        # no box walk nor ffprobe, the same bytes
+        parser = gpmf.Parser(self.config, index=index)
+        self.assertEqual(parser.readRawFromMP4(), self.data)
+        self.assertEqual(parser.sourceFps, probe.fps)
+
+    def test_select(self):
+        index = gpmf.Parser(self.config).buildIndex(probe)
+        payloads = range(len(self.payloads))
+        self.assertIn('GPS5', index.fourccs)
+        self.assertEqual(index.select(payloads, ['GPS5']), list(payloads))
+        self.assertEqual(index.select(payloads, ['CORI']), [])
+        self.assertEqual(index.select(range(3, 6), ['ACCL', 'CORI']), [3, 4, 5])
+
+    def test_stale(self):
+        gpmf.Parser(self.config).buildIndex(probe).save(self.path)
+        self.assertIsNone(GPMFIndex.load(self.path + '.missing', self.video))
+
+        stat = os.stat(self.video)
+        os.utime(self.video, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertIsNone(GPMFIndex.load(self.path, self.video))
+
+        with open(self.path, 'rb') as fd:
+            data = fd.read()
+        with open(self.path, 'wb') as fd:
+            fd.write(data[:-8])
+        self.assertIsNone(GPMFIndex.load(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
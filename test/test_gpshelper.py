@@ -0,0 +1,109 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Run from the repository root: python -m unittest discover test
+#
+
+import io
+import os
+import sys
+import math
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gopro2json import config
+from gopro2json import gpmf
+from gopro2json import gpshelper
+from gopro2json.gopro2json import BuildGPSPoints
+
+import mp4sample
+
+
+def track(name):
+    cfg = config.setup_environment(mp4sample.sample(name), binary=True)
+    return BuildGPSPoints(gpmf.Parser(cfg, fourccs=['GPS5']).readFromBinary())
+
+
+def meters(points, i):
+    "point i of the track in meters, on the plane douglas_peucker works in"
+    lat0 = math.radians(sum(points.latitude) / len(points))
+    scale = math.radians(1) * gpshelper.earth_radius
+    return points.longitude[i] * scale * math.cos(lat0), points.latitude[i] * scale
+
+
+def distance(p, a, b):
+    "from p to the line through a and b"
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    length = math.hypot(dx, dy)
+    if not length:
+        return math.hypot(p[0] - a[0], p[1] - a[1])
+    return abs(dx * (p[1] - a[1]) - dy * (p[0] - a[0])) / length
+
+
+class GPSTrackTest(unittest.TestCase):
+
+    def test_writers(self):
+        points = track('gopro7')
+        self.assertEqual(len(points), 1767)
+        for writer in (gpshelper.write_GPX, gpshelper.write_KML):
+            columns = io.StringIO()
+            objects = io.StringIO()
+            writer(points, columns)
+            writer(list(points), objects)
+            self.assertEqual(columns.getvalue(), objects.getvalue())
+
+    def test_point_time(self):
+        first = gpshelper.GPSPoint()
+        second = gpshelper.GPSPoint()
+        self.assertLessEqual(first.time, second.time)
+        self.assertFalse(hasattr(first, '__dict__'))
+
+
+class SimplifyTest(unittest.TestCase):
+
+    def test_decimate(self):
+        times = [0.0, 0.3, 0.6, 0.9, 1.2, 1.5, 2.4, 2.5]
+        self.assertEqual(gpshelper.decimate(times, 1.0), [0, 4, 6, 7])
+        self.assertEqual(gpshelper.decimate(times, 0.1), list(range(len(times))))
+        self.assertEqual(gpshelper.decimate([], 1.0), [])
+
+    def test_straight_line(self):
+        points = gpshelper.GPSTrack()
+        for i in range(50):
+            points.append(40.0 + i * 1e-5, -3.0, 600.0, 1000.0 + i)
+        self.assertEqual(gpshelper.douglas_peucker(points, range(len(points)), 0.5), [0, 49])
+
+        # a 10 m step east half way up the line north is kept with its
+        # neighbours, under the tolerance it isn't
+        points.longitude[25] += 10 / (math.radians(1) * gpshelper.earth_radius * math.cos(math.radians(40)))
+        self.assertEqual(gpshelper.douglas_peucker(points, range(len(points)), 5), [0, 24, 25, 26, 49])
+        self.assertEqual(gpshelper.douglas_peucker(points, range(len(points)), 20), [0, 49])
+
+    def test_tolerance(self):
+        points = track('gopro7')
+        for tolerance in (0.5, 2, 10):
+            kept = gpshelper.douglas_peucker(points, range(len(points)), tolerance)
+            self.assertEqual((kept[0], kept[-1]), (0, len(points) - 1))
+            self.assertLess(len(kept), len(points))
+            # every point dropped is within tolerance of the segment kept around it
+            for a, b in zip(kept, kept[1:]):
+                for i in range(a + 1, b):
+                    self.assertLessEqual(distance(meters(points, i), meters(points, a), meters(points, b)), tolerance + 1e-6)
+
+    def test_simplify(self):
+        points = track('gopro7')
+        simple = gpshelper.simplify(points, tolerance=2, interval=1)
+        self.assertLess(len(simple), len(gpshelper.decimate(points.time, 1)))
+        self.assertEqual(simple.time[0], points.time[0])
+        self.assertEqual(simple.time[-1], points.time[-1])
+        self.assertEqual(len(gpshelper.simplify(list(points))), len(points))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Run from the repository root: python -m unittest discover test
+#
+
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gopro2json import config
+from gopro2json import gpmf
+
+import mp4sample
+from mp4sample import klv
+
+
+def record(ms, tag, key=b'HMMT'):
+    "a highlight: its time in ms, a second numeric KLV, then how it was made"
+    return klv(key, ord('L'), struct.pack('>I', ms)) + klv(b'HMMS', ord('L'), struct.pack('>I', 7)) + \
+        klv(b'HLTY', ord('F'), tag)
+
+# moov/udta/GPMF of a camera: settings first, then the highlights
+highlights = (
+    klv(b'CASN', ord('c'), b'C3221324123456') +
+    klv(b'MANL', ord('c'), b'not in HLMT') +
+    klv(b'HLMT', 0,
+        record(1500, b'MANL') +
+        record(2750, b'AUTO') +
+        record(0, b'MANL') +
+        klv(b'HMMT', ord('J'), struct.pack('>Q', 9001)) + klv(b'MANL', ord('c'), b'\0\0\0\0') +
+        record(12345, b'MANL')))
+
+
+class HighlightsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(mp4sample.sample('gopro7'), 'rb') as fd:
+            self.data = fd.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def parser(self, content):
+        path = os.path.join(self.directory, 'GX010001.MP4')
+        mp4sample.build(self.data, path, gpmf=content)
+        return gpmf.Parser(config.setup_environment(path))
+
+    def test_manual(self):
+        "the manual ones, MANL as the tag or the key; the automatic and the 0 ms ones are left out"
+        parser = self.parser(highlights)
+        self.assertEqual(parser.extractHighlightTimecodes(), [1.5, 9.001, 12.345])
+
+    def test_truncated(self):
+        # the box ends inside the last record, before its tag
+        parser = self.parser(highlights[:-14])
+        self.assertEqual(parser.extractHighlightTimecodes(), [1.5, 9.001])
+        # in the middle of the header of its time
+        parser = self.parser(highlights[:-32])
+        self.assertEqual(parser.extractHighlightTimecodes(), [1.5, 9.001])
+
+    def test_no_highlights(self):
+        self.assertEqual(self.parser(None).extractHighlightTimecodes(), [])
+        self.assertEqual(self.parser(klv(b'CASN', ord('c'), b'C3221324123456')).extractHighlightTimecodes(), [])
+
+    def test_file(self):
+        "parse_highlights on the open file, as before the map"
+        parser = self.parser(highlights)
+        with open(parser.file, 'rb') as f:
+            boxes = parser.find_boxes(f)
+            moov = parser.find_boxes(f, boxes[b'moov'][0] + 8, boxes[b'moov'][1])
+            udta = parser.find_boxes(f, moov[b'udta'][0] + 8, moov[b'udta'][1])
+            self.assertEqual(parser.parse_highlights(f, udta[b'GPMF'][0] + 8, udta[b'GPMF'][1]), [1.5, 9.001, 12.345])
+
+
+if __name__ == '__main__':
+    unittest.main()
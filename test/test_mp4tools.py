@@ -0,0 +1,110 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Run from the repository root: python -m unittest discover test
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gopro2json import config
+from gopro2json import gpmf
+from gopro2json import mp4tools
+
+import mp4sample
+
+
+class MP4ToolsTest(unittest.TestCase):
+    "the gpmd track read from the sample tables is the dump it was built from"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(mp4sample.sample('gopro7'), 'rb') as fd:
+            self.data = fd.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def parser(self, **build):
+        path = os.path.join(self.directory, 'GX010001.MP4')
+        self.payloads = mp4sample.build(self.data, path, **build)
+        return gpmf.Parser(config.setup_environment(path))
+
+    def test_extract(self):
+        for build in ({}, {'per_chunk': 1}, {'per_chunk': 4}, {'co64': True, 'largesize': True}):
+            with self.subTest(**build):
+                parser = self.parser(**build)
+                self.assertEqual(parser.readRawFromMP4(), self.data)
+
+    def test_sample_table(self):
+        parser = self.parser(per_chunk=4)
+        track = parser.track
+        self.assertEqual(track.track, 1)
+        self.assertEqual(track.timescale, mp4sample.timescale)
+        self.assertEqual(list(track.sizes), [len(p) for p in self.payloads])
+        # chunks of 4 then the rest, each chunk after 37 bytes of filler
+        self.assertEqual(track.offsets[1] - track.offsets[0], track.sizes[0])
+        self.assertEqual(track.offsets[4] - track.offsets[3], track.sizes[3] + 37)
+        self.assertAlmostEqual(track.times[10], 10 * 1.001)
+        self.assertAlmostEqual(track.durations[-1], 1.001)
+
+    def test_missing_box(self):
+        "a broken gpmd trak says which box it lacks"
+        for text in (b'stsz', b'stco', b'stsc', b'stts', b'mdhd'):
+            with self.subTest(box=text):
+                parser = self.parser()
+                with open(parser.file, 'rb') as fd:
+                    data = fd.read()
+                # the last one is in the gpmd trak (mdhd is in both)
+                at = data.rindex(text)
+                with open(parser.file, 'wb') as fd:
+                    fd.write(data[:at] + b'free' + data[at + 4:])
+                with self.assertRaisesRegex(Exception, 'Box .*%s of the gpmd track 1 not found' % text.decode()):
+                    parser.readRawFromMP4()
+
+    def test_payload_range(self):
+        parser = self.parser()
+        track = parser.track
+        tools = parser.mp4tools
+        self.assertEqual(tools.payloadRange(track), (0, len(self.payloads)))
+        self.assertEqual(tools.payloadRange(track, 3.0, 6.0), (2, 6))
+        self.assertEqual(tools.payloadRange(track, 3.003, 6.006), (3, 6))
+        self.assertEqual(tools.payloadRange(track, end=0.5), (0, 1))
+        self.assertEqual(tools.payloadRange(track, start=1000.0), (len(self.payloads), len(self.payloads)))
+
+        self.assertEqual(parser.readRawFromMP4(3.0, 6.0), b''.join(self.payloads[2:6]))
+
+    def test_box_index(self):
+        parser = self.parser()
+        with mp4tools.open_mmap(parser.file) as data:
+            index = mp4tools.BoxIndex(data)
+            self.assertEqual(len(index.find('moov/trak[*]')), 2)
+            self.assertEqual(index.first('moov/trak[1]/mdia/minf/stbl/stsd').type, b'stsd')
+            self.assertIsNone(index.first('moov/udta/GPMF'))
+            self.assertEqual(sorted(parser.find_boxes(data)), [b'ftyp', b'mdat', b'moov'])
+
+    def test_find_boxes(self):
+        "Parser.find_boxes takes the open file, as it did before the map, or the map"
+        parser = self.parser(largesize=True)
+        with open(parser.file, 'rb') as f:
+            boxes = parser.find_boxes(f)
+            self.assertEqual(sorted(boxes), [b'ftyp', b'mdat', b'moov'])
+            self.assertEqual(boxes[b'ftyp'], (0, 20))
+            self.assertEqual(boxes[b'moov'][1], os.path.getsize(parser.file))
+            moov = parser.find_boxes(f, boxes[b'moov'][0] + 8, boxes[b'moov'][1])
+            self.assertEqual(sorted(moov), [b'mvhd', b'trak'])
+        with mp4tools.open_mmap(parser.file) as data:
+            self.assertEqual(parser.find_boxes(data), boxes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#
+# Mikael Lavi <mikael.lavi@gmail.com>
+# https://github.com/kjue/gopro2json.git
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+# Run from the repository root: python -m unittest discover test
+#
+
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gopro2json import config
+from gopro2json import gpmf
+from gopro2json import fourCC
+from gopro2json import samplestore
+
+import mp4sample
+
+
+def accl_store(name):
+    "a SampleStore with the first ACCL and GYRO reading of every payload of the sample"
+    cfg = config.setup_environment(mp4sample.sample(name), binary=True)
+    store = samplestore.SampleStore()
+    SCAL = None
+    for d in gpmf.Parser(cfg, fourccs=['ACCL', 'GYRO']).readFromBinary():
+        if d.fourCC == 'SCAL':
+            SCAL = d.data
+        elif d.fourCC == 'ACCL':
+            i = store.append(len(store) * 1001, len(store) * 1001000 if len(store) % 3 else None, SCAL)
+            store.set(i, 'ACCL', d.data.sample(0), 'q')
+        elif d.fourCC == 'GYRO' and len(store):
+            store.set(len(store) - 1, 'GYRO', d.data.sample(0), 'd')
+    return store
+
+
+class SampleStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_columns_round_trip(self):
+        store = accl_store('hero6')
+        self.assertGreater(len(store), 0)
+        path = os.path.join(self.directory, 'hero6.cols')
+        with open(path, 'wb') as fd:
+            samplestore.dump_columns(store, fd, {'camera': 'C3'})
+
+        layout, columns = samplestore.load_columns(path)
+        self.assertEqual(layout['samples'], len(store))
+        self.assertEqual(layout['document'], {'camera': 'C3'})
+        for column in layout['columns'].values():
+            self.assertEqual(column['offset'] % 8, 0)
+
+        # the rows rebuilt from the columns are the JSON of the store, the
+        # axes as float64 in the file
+        rows = []
+        for i in range(layout['samples']):
+            row = {
+                'CTS': columns['CTS'][i],
+                'VPTS': columns['VPTS'][i] if columns['VPTS.present'][i] else None,
+                'SCAL': layout['scales'][columns['SCAL'][i]]
+            }
+            for fourCC, stream in store.streams.items():
+                if columns['%s.present' % fourCC][i]:
+                    row[fourCC] = dict((axis, columns['%s.%s' % (fourCC, axis)][i]) for axis in stream.axes)
+            rows.append(row)
+        self.assertEqual(rows, json.loads(json.dumps(store, default=samplestore.to_json)))
+
+    def test_dump(self):
+        store = accl_store('gopro7')
+        document = {'streams': {'samples': store}, 'camera': 'C3'}
+        fd = io.StringIO()
+        samplestore.dump(document, fd, block=7)
+        self.assertEqual(fd.getvalue(), json.dumps(document, default=samplestore.to_json))
+
+    def test_scales(self):
+        store = samplestore.SampleStore()
+        for i in range(70000):
+            store.append(i, i, fourCC.XYZData(1.0, 2.0, float(i % 3)))
+        store.append(70000, None, 1)
+        store.append(70001, None, 1.0)
+        self.assertEqual(len(store.scales), 5)
+        self.assertEqual(store.row(69999)['SCAL'], fourCC.XYZData(1.0, 2.0, 0.0))
+        self.assertEqual(repr(store.row(70001)['SCAL']), '1.0')
+
+
+if __name__ == '__main__':
+    unittest.main()